@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# Copyright (C) 2019-2020 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmarks for netlist parsing, BOM generation and CPL rotation fixing.
+
+Generates deterministic KiCad-style XML netlists, -all-pos.csv files and
+rotation databases of configurable size, times each processing stage
+separately and prints the results as JSON, so that runs from different
+commits can be compared. Example:
+
+    python benchmarks/benchmark.py --sizes 1000 10000 --footprints 50 --rules 60
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jlc_kicad_tools import __version__  # noqa: E402
+from jlc_kicad_tools.logger import Log  # noqa: E402
+from jlc_kicad_tools.jlc_lib import kicad_netlist_reader  # noqa: E402
+from jlc_kicad_tools.jlc_lib.cpl_fix_rotations import (  # noqa: E402
+    CPL_BACKENDS,
+    DatabaseEntry,
+    FixRotations,
+    RotationRules,
+)
+from jlc_kicad_tools.jlc_lib.generate_bom import BOM_NETLIST_SECTIONS, WriteBOM  # noqa: E402
+
+REF_PREFIXES = ["R", "C", "L", "D", "U", "Q", "J", "SW", "Y", "FB"]
+VALUES = ["10k", "4k7", "100n", "1u", "10u", "22p", "BAT54", "LM358", "AMS1117-3.3", "STM32F103"]
+
+_LOGGER = Log()
+
+
+def FootprintName(index):
+    return "PKG{}_{}x{}mm".format(index, 1 + index % 7, 1 + index % 5)
+
+
+def GenerateNetlist(filename, components, footprints, seed=0):
+    """Write a KiCad generic netlist with the given number of components,
+    spread over the given number of distinct footprints. Each component gets
+    a net of three nodes, so the nets section grows with the design like it
+    does in real netlists.
+    """
+    rng = random.Random(seed)
+    libparts = [("Device", "P{}".format(i)) for i in range(max(1, footprints // 2))]
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<export version="D">\n')
+        f.write("  <design>\n    <source>bench.sch</source>\n    <date>today</date>\n")
+        f.write("    <tool>Eeschema</tool>\n  </design>\n  <components>\n")
+        for i in range(components):
+            lib, part = rng.choice(libparts)
+            value = rng.randrange(len(VALUES))
+            footprint = rng.randrange(footprints)
+            f.write('    <comp ref="{}{}">\n'.format(rng.choice(REF_PREFIXES), i + 1))
+            f.write("      <value>{}</value>\n".format(VALUES[value]))
+            f.write("      <footprint>Lib:{}</footprint>\n".format(FootprintName(footprint)))
+            f.write("      <fields>\n")
+            # Same part number for the same value and footprint, so that
+            # components form realistic groups.
+            f.write(
+                '        <field name="LCSC">C{}</field>\n'.format(
+                    1000 + value * footprints + footprint
+                )
+            )
+            f.write("      </fields>\n")
+            f.write('      <libsource lib="{}" part="{}" description="d"/>\n'.format(lib, part))
+            f.write('      <sheetpath names="/" tstamps="/"/>\n')
+            f.write("      <tstamp>{:08X}</tstamp>\n    </comp>\n".format(i))
+        f.write("  </components>\n  <libparts>\n")
+        for lib, part in libparts:
+            f.write('    <libpart lib="{}" part="{}">\n'.format(lib, part))
+            f.write("      <aliases>\n        <alias>{}_alt</alias>\n      </aliases>\n".format(part))
+            f.write("      <description>d</description>\n      <fields>\n")
+            f.write('        <field name="Reference">X</field>\n')
+            f.write('        <field name="Value">{}</field>\n'.format(part))
+            f.write("      </fields>\n")
+            f.write('      <pins>\n        <pin num="1" name="~" type="passive"/>\n')
+            f.write('        <pin num="2" name="~" type="passive"/>\n      </pins>\n')
+            f.write("    </libpart>\n")
+        f.write("  </libparts>\n  <libraries>\n")
+        f.write('    <library logical="Device">\n      <uri>device.lib</uri>\n    </library>\n')
+        f.write("  </libraries>\n  <nets>\n")
+        for i in range(components):
+            f.write('    <net code="{}" name="N{}">\n'.format(i + 1, i + 1))
+            for pin in range(3):
+                f.write(
+                    '      <node ref="R{}" pin="{}"/>\n'.format(rng.randrange(components) + 1, pin)
+                )
+            f.write("    </net>\n")
+        f.write("  </nets>\n</export>\n")
+
+
+def GenerateCPL(filename, components, footprints, seed=0):
+    """Write a Pcbnew -all-pos.csv file with the given number of rows"""
+    rng = random.Random(seed)
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("Ref,Val,Package,PosX,PosY,Rot,Side\n")
+        for i in range(components):
+            side = "bottom" if rng.random() < 0.3 else "top"
+            posx = rng.uniform(0, 200)
+            if side == "bottom":
+                posx = -posx
+            f.write(
+                '"{}{}","{}","{}",{:.4f},{:.4f},{:.6f},{}\n'.format(
+                    rng.choice(REF_PREFIXES),
+                    i + 1,
+                    rng.choice(VALUES),
+                    FootprintName(rng.randrange(footprints)),
+                    posx,
+                    rng.uniform(0, 200),
+                    rng.choice([0.0, 90.0, 180.0, 270.0]),
+                    side,
+                )
+            )
+
+
+def GenerateDB(rules, footprints, seed=0):
+    """Return a rotation database with the given number of rules. Most are
+    '^PREFIX' rules like the bundled database, every tenth one needs the
+    regex engine.
+    """
+    rng = random.Random(seed)
+    db = {}
+    for i in range(rules):
+        index = rng.randrange(footprints)
+        if i % 10 == 9:
+            pattern = "^(.*?_)?PKG{}_[0-9]x".format(index)
+        else:
+            pattern = "^PKG{}_".format(index)
+        db[re.compile(pattern)] = DatabaseEntry(
+            rotation=rng.choice([-90, 90, 180, 270]), offset_x=0.0, offset_y=0.0
+        )
+    return db
+
+
+class _DeferredNetlist(kicad_netlist_reader.netlist):
+    # Skips libpart linking at the end of parsing, so it can be timed on its own.
+    def endDocument(self):
+        pass
+
+
+def Timed(function, *args):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    result = function(*args)
+    return result, time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+
+def RunOnce(work_dir, components, opts):
+    netlist_path = os.path.join(work_dir, "bench.xml")
+    cpl_path = os.path.join(work_dir, "bench-all-pos.csv")
+    bom_output_path = os.path.join(work_dir, "bench_bom_jlc.csv")
+    cpl_output_path = os.path.join(work_dir, "bench_cpl_jlc.csv")
+
+    stages = {}
+
+    def Record(name, wall, cpu):
+        stages[name] = {"wall": wall, "cpu": cpu}
+
+    net, wall, cpu = Timed(
+        _DeferredNetlist,
+        netlist_path,
+        BOM_NETLIST_SECTIONS,
+        opts.netlist_backend,
+        True,
+    )
+    Record("parse", wall, cpu)
+
+    _, wall, cpu = Timed(kicad_netlist_reader.netlist.endDocument, net)
+    Record("libpart_link", wall, cpu)
+
+    groups, wall, cpu = Timed(net.groupComponents)
+    Record("group", wall, cpu)
+
+    # WriteBOM groups the components again, so this includes grouping.
+    _, wall, cpu = Timed(WriteBOM, net, bom_output_path, opts)
+    Record("bom_write", wall, cpu)
+
+    db = GenerateDB(opts.rules, opts.footprints, opts.seed)
+    rules, wall, cpu = Timed(RotationRules, db)
+    Record("rules_compile", wall, cpu)
+
+    _, wall, cpu = Timed(FixRotations, cpl_path, cpl_output_path, rules, opts.cpl_backend)
+    Record("cpl_transform", wall, cpu)
+
+    return stages, len(net.components), len(groups)
+
+
+def GetOpts():
+    parser = argparse.ArgumentParser(
+        description="Times netlist parsing, BOM generation and CPL rotation fixing on "
+        "synthetic inputs and prints the results as JSON",
+    )
+    parser.add_argument(
+        "--sizes",
+        metavar="N",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+        help="Numbers of components to benchmark. Default: 1000 10000",
+    )
+    parser.add_argument(
+        "--footprints",
+        metavar="N",
+        type=int,
+        default=50,
+        help="Number of distinct footprints. Default: 50",
+    )
+    parser.add_argument(
+        "--rules",
+        metavar="M",
+        type=int,
+        default=60,
+        help="Number of rotation rules. Default: 60",
+    )
+    parser.add_argument(
+        "--repeat",
+        metavar="R",
+        type=int,
+        default=3,
+        help="Runs per size; the fastest wall time of each stage is reported. Default: 3",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    parser.add_argument(
+        "--netlist-backend",
+        choices=kicad_netlist_reader.NETLIST_BACKENDS,
+        dest="netlist_backend",
+        default="sax",
+        help="Netlist XML backend. Default: sax",
+    )
+    parser.add_argument(
+        "--cpl-backend",
+        choices=CPL_BACKENDS,
+        dest="cpl_backend",
+        default="rows",
+        help="CPL transform backend. Default: rows",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        help="Write the JSON results to FILE instead of standard output",
+    )
+    opts = parser.parse_args()
+
+    # Options read by WriteBOM
+    opts.warn_no_partnumber = False
+    opts.include_all_groups = False
+    return opts
+
+
+def main():
+    opts = GetOpts()
+    _LOGGER.SetLevel(0)
+
+    results = []
+    for components in opts.sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            _, generate_time, _ = Timed(
+                lambda: (
+                    GenerateNetlist(
+                        os.path.join(work_dir, "bench.xml"),
+                        components,
+                        opts.footprints,
+                        opts.seed,
+                    ),
+                    GenerateCPL(
+                        os.path.join(work_dir, "bench-all-pos.csv"),
+                        components,
+                        opts.footprints,
+                        opts.seed,
+                    ),
+                )
+            )
+
+            best = {}
+            for _ in range(opts.repeat):
+                stages, parsed, groups = RunOnce(work_dir, components, opts)
+                for name, timing in stages.items():
+                    if name not in best or timing["wall"] < best[name]["wall"]:
+                        best[name] = timing
+
+            results.append(
+                {
+                    "components": components,
+                    "components_parsed": parsed,
+                    "groups": groups,
+                    "netlist_bytes": os.path.getsize(os.path.join(work_dir, "bench.xml")),
+                    "generate_seconds": generate_time,
+                    "stages": best,
+                }
+            )
+        print(
+            "{} components: {}".format(
+                components,
+                ", ".join(
+                    "{} {:.3f}s".format(name, timing["wall"]) for name, timing in best.items()
+                ),
+            ),
+            file=sys.stderr,
+        )
+
+    report = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "netlist_backend": opts.netlist_backend,
+        "cpl_backend": opts.cpl_backend,
+        "footprints": opts.footprints,
+        "rules": opts.rules,
+        "repeat": opts.repeat,
+        "seed": opts.seed,
+        "results": results,
+    }
+
+    if opts.output:
+        with open(opts.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+# Copyright (C) 2019-2020 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Checks of the KiCad 6+ schematic and board readers against the XML
+netlist and CSV position file paths.
+
+Writes small schematics and boards together with the netlist and position
+file KiCad exports for them, and checks that the BOM and CPL made from
+either are the same. The files cover strings holding parentheses and
+escaped quotes, a sheet used twice, symbols left out of the BOM, multi-unit
+symbols, KiCad 5 modules and bottom-side footprints, and are padded so that
+items straddle the chunks files are read in. The S-expression tokenizer is
+also checked with every chunk size on a short text. Prints the failures and
+exits with a non-zero status if there are any. Example:
+
+    python benchmarks/check_readers.py
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from jlc_kicad_tools.logger import Log  # noqa: E402
+from jlc_kicad_tools.jlc_lib import sexpr  # noqa: E402
+from jlc_kicad_tools.jlc_lib.cpl_fix_rotations import (  # noqa: E402
+    GenerateCPLRows,
+    ReadRotationRules,
+)
+from jlc_kicad_tools.jlc_lib.generate_bom import BOMOptions, GenerateBOMRows  # noqa: E402
+
+DB_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "jlc_kicad_tools", "cpl_rotations_db.csv"
+)
+
+ROOT_UUID = "11111111-1111-1111-1111-111111111111"
+CHANNEL_A_UUID = "22222222-2222-2222-2222-222222222222"
+CHANNEL_B_UUID = "33333333-3333-3333-3333-333333333333"
+FILTER_UUID = "44444444-4444-4444-4444-444444444444"
+
+# Library symbols: lib_id -> (description, default footprint)
+LIB_SYMBOLS = {
+    "Device:R": ("Resistor", ""),
+    "Device:C": ("Unpolarized capacitor", ""),
+    "Amp:OPA2": ("Dual op amp (SOIC)", "Package_SO:SOIC-8_3.9x4.9mm_P1.27mm"),
+    "Connector:TestPoint": ("Test point", ""),
+    "power:GND": ("", ""),
+}
+
+# Symbols of the root sheet: (lib_id, reference, value, footprint, LCSC part
+# number, unit, in_bom). U1 has two units.
+ROOT_SYMBOLS = [
+    ("Device:R", "R1", "10k", "Resistor_SMD:R_0603_1608Metric", "C25804", 1, True),
+    ("Device:R", "R2", "10k", "Resistor_SMD:R_0603_1608Metric", "C25804", 1, True),
+    ("Device:C", "C1", '100n (X7R, "50V")', "Capacitor_SMD:C_0402_1005Metric", "C1525", 1, True),
+    ("Amp:OPA2", "U1", "OPA2", "Package_SO:SOIC-8_3.9x4.9mm_P1.27mm", "C7426", 1, True),
+    ("Amp:OPA2", "U1", "OPA2", "Package_SO:SOIC-8_3.9x4.9mm_P1.27mm", "C7426", 2, True),
+    ("power:GND", "#PWR01", "GND", "", "", 1, True),
+    ("Connector:TestPoint", "TP1", "TestPoint", "TestPoint:TestPoint_Pad_D1.0mm", "", 1, False),
+]
+
+# Symbols of the channel sheet, used by two sheets: (lib_id, references in
+# the first and second sheet, value, footprint, LCSC part number, in_bom)
+CHANNEL_SYMBOLS = [
+    ("Device:R", ("R10", "R20"), "1k", "Resistor_SMD:R_0603_1608Metric", "C21190", True),
+    ("Device:C", ("C10", "C20"), "100n", "Capacitor_SMD:C_0402_1005Metric", "C1525", True),
+    ("Connector:TestPoint", ("TP10", "TP20"), "TestPoint", "TestPoint:TestPoint_Pad_D1.0mm", "", False),
+]
+
+# Symbols of the filter sheet, used by the channel sheet, like CHANNEL_SYMBOLS
+FILTER_SYMBOLS = [
+    ("Device:R", ("R11", "R21"), "4k7", "Resistor_SMD:R_0402_1005Metric", "", True),
+]
+
+# Footprints of the board: (reference, value, footprint, x, y, rotation,
+# bottom side, left out of position files)
+FOOTPRINTS = [
+    ("R1", "10k", "Resistor_SMD:R_0603_1608Metric", 120.5, 80.25, 0, False, False),
+    ("R2", "10k", "Resistor_SMD:R_0603_1608Metric", 125.5, 80.25, 90, True, False),
+    ("C1", "100n (X7R)", "Capacitor_SMD:C_0402_1005Metric", 130.0, 85.5, 180, True, False),
+    ("U1", "OPA2", "Package_SO:SOIC-8_3.9x4.9mm_P1.27mm", 140.125, 90.0, -90, False, False),
+    ("Q2", "BC847", "Package_TO_SOT_SMD:SOT-23", 150.0, 70.0, 45, True, False),
+    ("H1", "MountingHole", "MountingHole:MountingHole_3.2mm_M3", 100.0, 100.0, 0, False, True),
+]
+
+_LOGGER = Log()
+
+
+def Quote(text):
+    return '"{}"'.format(text.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def Padding(count):
+    """Return count pairs of items that the readers skip, the second holding
+    a string with parentheses and escaped quotes.
+    """
+    return "".join(
+        "  (wire (pts (xy {0} 50) (xy {0} 60)) (stroke (width 0) (type default)) "
+        "(uuid 0f0f0f0f-0000-0000-0000-{0:012d}))\n"
+        '  (text "note (see \\"R{0}\\") :)" (at 10 10 0))\n'.format(i)
+        for i in range(count)
+    )
+
+
+# S-expression text read with every chunk size, and the items expected from it
+SEXPR_TEXT = (
+    '(kicad_sch (version 20230121) (generator "eeschema")\n'
+    '  (text "a (symbol \\"b\\") c" (at 1 2 0))\n'
+    '  (symbol (lib_id "Device:R") (property "Value" "10k (1%)")\n'
+    '    (property "Note" "say \\"hi\\" ) (" (at 0 0 0)) (uuid 1234))\n'
+    '  (label "))((" (at 3 4 0))\n'
+    '  (symbol (lib_id "Amp:OPA2") (property "Datasheet" "C:\\\\x\\\\\\"q\\".pdf")\n'
+    '    (property "Multi" "line\none") (empty ()))\n'
+    ")\n"
+)
+
+SEXPR_ITEMS = [
+    "kicad_sch",
+    [
+        "symbol",
+        ["lib_id", "Device:R"],
+        ["property", "Value", "10k (1%)"],
+        ["property", "Note", 'say "hi" ) (', ["at", "0", "0", "0"]],
+        ["uuid", "1234"],
+    ],
+    [
+        "symbol",
+        ["lib_id", "Amp:OPA2"],
+        ["property", "Datasheet", 'C:\\x\\"q".pdf'],
+        ["property", "Multi", "line\none"],
+        ["empty", []],
+    ],
+]
+
+
+def Compare(name, read, expected):
+    """Return the failures of read(), which returns the rows read by name"""
+    try:
+        rows = read()
+    except Exception as e:
+        return ["{}: raised {!r}".format(name, e)]
+    if rows != expected:
+        return ["{}: read {!r}, expected {!r}".format(name, rows, expected)]
+    return []
+
+
+def CheckTokenizer():
+    """Return the failures of reading SEXPR_TEXT with every chunk size"""
+    failures = []
+    for chunk_size in range(1, len(SEXPR_TEXT) + 1):
+        failures += Compare(
+            "tokenizer, chunk size {}".format(chunk_size),
+            lambda: list(
+                sexpr.ReadItems(io.StringIO(SEXPR_TEXT), ("symbol",), chunk_size=chunk_size)
+            ),
+            SEXPR_ITEMS,
+        )
+    return failures
+
+
+def LibSymbols():
+    text = "  (lib_symbols\n"
+    for lib_id, (description, footprint) in LIB_SYMBOLS.items():
+        text += "    (symbol {} (in_bom yes) (on_board yes)\n".format(Quote(lib_id))
+        text += '      (property "Reference" "X" (id 0) (at 0 0 0))\n'
+        text += '      (property "Value" {} (id 1) (at 0 0 0))\n'.format(
+            Quote(lib_id.split(":")[1])
+        )
+        text += '      (property "Footprint" {} (id 2) (at 0 0 0))\n'.format(Quote(footprint))
+        if description:
+            text += '      (property "ki_description" {} (id 5) (at 0 0 0))\n'.format(
+                Quote(description)
+            )
+        text += '      (symbol "{}_1_1" (pin passive line (at 0 3.81 270) (length 1.27)))\n'.format(
+            lib_id.split(":")[1]
+        )
+        text += "    )\n"
+    return text + "  )\n"
+
+
+def Symbol(lib_id, uuid, reference, value, footprint, lcsc, unit, in_bom, instances):
+    """Return a placed symbol. instances are the (path, reference) of its
+    KiCad 7+ instances, None for a KiCad 6 schematic.
+    """
+    text = "  (symbol (lib_id {}) (at 100 80 0) (unit {})\n".format(Quote(lib_id), unit)
+    text += "    (in_bom {}) (on_board yes) (uuid {})\n".format("yes" if in_bom else "no", uuid)
+    properties = [("Reference", reference), ("Value", value), ("Footprint", footprint)]
+    properties += [("Datasheet", "~")]
+    if lcsc:
+        properties.append(("LCSC", lcsc))
+    for index, (name, text_value) in enumerate(properties):
+        text += "    (property {} {} (id {}) (at 0 0 0)\n".format(
+            Quote(name), Quote(text_value), index
+        )
+        text += "      (effects (font (size 1.27 1.27)) hide))\n"
+    text += '    (pin "1" (uuid {}-0001))\n'.format(uuid[:-5])
+    if instances is not None:
+        text += '    (instances\n      (project "check"\n'
+        for path, instance_reference in instances:
+            text += "        (path {} (reference {}) (unit {}))\n".format(
+                Quote(path), Quote(instance_reference), unit
+            )
+        text += "      )\n    )\n"
+    return text + "  )\n"
+
+
+def Sheet(uuid, name, filename, version):
+    name_property, file_property = ("Sheetname", "Sheetfile") if version >= 7 else (
+        "Sheet name",
+        "Sheet file",
+    )
+    return (
+        "  (sheet (at 150 50) (size 20 20)\n"
+        "    (uuid {})\n"
+        "    (property {} {} (id 0) (at 150 49 0))\n"
+        "    (property {} {} (id 1) (at 150 71 0))\n"
+        '    (pin "IN (a)" input (at 150 55 180))\n'
+        "  )\n"
+    ).format(uuid, Quote(name_property), Quote(name), Quote(file_property), Quote(filename))
+
+
+def SheetSymbols(symbols, uuid_prefix, sheet_paths, version, symbol_instances):
+    """Return the symbols of a sheet used by the sheets at sheet_paths, a
+    list of (KiCad 7+ instance path, KiCad 6 path prefix) with one entry per
+    reference of each symbol. Adds their KiCad 6 instances to
+    symbol_instances.
+    """
+    text = ""
+    for index, (lib_id, references, value, footprint, lcsc, in_bom) in enumerate(symbols):
+        uuid = "{}-0000-0000-0000-{:012d}".format(uuid_prefix, index)
+        instances = None
+        if version >= 7:
+            instances = [(path, ref) for (path, _), ref in zip(sheet_paths, references)]
+        text += Symbol(lib_id, uuid, references[0], value, footprint, lcsc, 1, in_bom, instances)
+        for (_, prefix), reference in zip(sheet_paths, references):
+            symbol_instances.append((prefix + uuid, reference, value, footprint))
+    return text
+
+
+def WriteSchematic(work_dir, version, padding):
+    """Write a schematic hierarchy in the KiCad 6 or KiCad 7+ format, whose
+    channel sheet is used twice and itself uses the filter sheet. Returns the
+    root schematic file name.
+    """
+    # KiCad 6: symbol path -> reference, value, footprint, in the root sheet
+    symbol_instances = []
+
+    root_symbols = ""
+    for index, (lib_id, reference, value, footprint, lcsc, unit, in_bom) in enumerate(
+        ROOT_SYMBOLS
+    ):
+        uuid = "aaaaaaaa-0000-0000-0000-{:012d}".format(index)
+        instances = [("/" + ROOT_UUID, reference)] if version >= 7 else None
+        root_symbols += Symbol(
+            lib_id, uuid, reference, value, footprint, lcsc, unit, in_bom, instances
+        )
+        symbol_instances.append(("/" + uuid, reference, value, footprint))
+
+    channels = [CHANNEL_A_UUID, CHANNEL_B_UUID]
+    channel_symbols = SheetSymbols(
+        CHANNEL_SYMBOLS,
+        "bbbbbbbb",
+        [("/{}/{}".format(ROOT_UUID, channel), "/{}/".format(channel)) for channel in channels],
+        version,
+        symbol_instances,
+    )
+    filter_symbols = SheetSymbols(
+        FILTER_SYMBOLS,
+        "dddddddd",
+        [
+            ("/{}/{}/{}".format(ROOT_UUID, channel, FILTER_UUID), "/{}/{}/".format(channel, FILTER_UUID))
+            for channel in channels
+        ],
+        version,
+        symbol_instances,
+    )
+
+    def Header(uuid):
+        return "(kicad_sch (version {}) (generator eeschema)\n\n  (uuid {})\n\n".format(
+            20230121 if version >= 7 else 20211123, uuid
+        )
+
+    root_path = os.path.join(work_dir, "check.kicad_sch")
+    with open(root_path, "w", encoding="utf-8") as f:
+        f.write(Header(ROOT_UUID))
+        f.write(LibSymbols())
+        f.write(Padding(padding))
+        f.write(root_symbols)
+        f.write(Sheet(CHANNEL_A_UUID, "Channel (A)", "channel.kicad_sch", version))
+        f.write(Sheet(CHANNEL_B_UUID, "Channel B", "channel.kicad_sch", version))
+        f.write(Padding(padding))
+        f.write('  (sheet_instances\n    (path "/" (page "1"))\n  )\n')
+        if version < 7:
+            f.write("  (symbol_instances\n")
+            for path, reference, value, footprint in symbol_instances:
+                f.write(
+                    "    (path {} (reference {}) (unit 1) (value {}) (footprint {}))\n".format(
+                        Quote(path), Quote(reference), Quote(value), Quote(footprint)
+                    )
+                )
+            f.write("  )\n")
+        f.write(")\n")
+
+    with open(os.path.join(work_dir, "channel.kicad_sch"), "w", encoding="utf-8") as f:
+        f.write(Header("cccccccc-0000-0000-0000-000000000000"))
+        f.write(LibSymbols())
+        f.write(Padding(padding))
+        f.write(channel_symbols)
+        # Relative to this sheet
+        f.write(Sheet(FILTER_UUID, "Filter", "sub/filter.kicad_sch", version))
+        f.write(")\n")
+
+    os.makedirs(os.path.join(work_dir, "sub"))
+    with open(os.path.join(work_dir, "sub", "filter.kicad_sch"), "w", encoding="utf-8") as f:
+        f.write(Header("eeeeeeee-0000-0000-0000-000000000000"))
+        f.write(LibSymbols())
+        f.write(filter_symbols)
+        f.write(")\n")
+
+    return root_path
+
+
+def WriteNetlist(filename):
+    """Write the XML netlist Eeschema exports for the schematics written by
+    WriteSchematic.
+    """
+    components = {}
+    for lib_id, reference, value, footprint, lcsc, unit, in_bom in ROOT_SYMBOLS:
+        if in_bom and not reference.startswith("#"):
+            components[reference] = (lib_id, value, footprint, lcsc)
+    for lib_id, references, value, footprint, lcsc, in_bom in CHANNEL_SYMBOLS + FILTER_SYMBOLS:
+        if in_bom:
+            for reference in references:
+                components[reference] = (lib_id, value, footprint, lcsc)
+
+    def Escape(text):
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;")
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<export version="E">\n')
+        f.write("  <components>\n")
+        for reference, (lib_id, value, footprint, lcsc) in components.items():
+            lib, part = lib_id.split(":")
+            f.write('    <comp ref="{}">\n'.format(reference))
+            f.write("      <value>{}</value>\n".format(Escape(value)))
+            f.write("      <footprint>{}</footprint>\n".format(footprint))
+            f.write("      <datasheet>~</datasheet>\n")
+            if lcsc:
+                f.write('      <fields>\n        <field name="LCSC">{}</field>\n'.format(lcsc))
+                f.write("      </fields>\n")
+            f.write(
+                '      <libsource lib="{}" part="{}" description="{}"/>\n'.format(
+                    lib, part, Escape(LIB_SYMBOLS[lib_id][0])
+                )
+            )
+            f.write("    </comp>\n")
+        f.write("  </components>\n  <libparts>\n")
+        for lib_id, (description, footprint) in LIB_SYMBOLS.items():
+            lib, part = lib_id.split(":")
+            f.write('    <libpart lib="{}" part="{}">\n'.format(lib, part))
+            f.write("      <description>{}</description>\n".format(Escape(description)))
+            f.write('      <fields>\n        <field name="Reference">X</field>\n')
+            f.write('        <field name="Value">{}</field>\n'.format(part))
+            if footprint:
+                f.write('        <field name="Footprint">{}</field>\n'.format(footprint))
+            f.write("      </fields>\n    </libpart>\n")
+        f.write("  </libparts>\n</export>\n")
+
+
+def Footprint(reference, value, footprint, x, y, rotation, bottom, excluded, version):
+    """Return a placed footprint of a KiCad 5 (module), 6 or 8+ board"""
+    side = "B" if bottom else "F"
+    at = "(at {} {}{})".format(x, y, " {}".format(rotation) if rotation else "")
+    if version == 5:
+        text = "  (module {} (layer {}.Cu) (tedit 5F68FEEE) (tstamp 5F8A1C2B)\n".format(
+            footprint, side
+        )
+        text += "    {}\n".format(at)
+        text += '    (descr "{} (SMD), \\"square\\"")\n'.format(footprint.split(":")[1])
+        text += "    (attr {})\n".format("virtual" if excluded else "smd")
+        text += "    (fp_text reference {} (at 0 -1.43) (layer {}.SilkS)\n".format(reference, side)
+        text += "      (effects (font (size 1 1) (thickness 0.15)) (justify mirror))\n    )\n"
+        text += "    (fp_text value {} (at 0 1.43) (layer {}.Fab)\n".format(Quote(value), side)
+        text += "      (effects (font (size 1 1) (thickness 0.15)))\n    )\n"
+        text += "    (pad 1 smd roundrect (at -0.7875 0) (size 0.875 0.95) "
+        text += "(layers {0}.Cu {0}.Paste {0}.Mask))\n".format(side)
+        text += "    (model ${KISYS3DMOD}/x.wrl\n      (at (xyz 0 0 0))\n    )\n"
+        return text + "  )\n"
+
+    text = '  (footprint {} (layer "{}.Cu")\n    {}\n'.format(Quote(footprint), side, at)
+    if version >= 8:
+        for name, property_value in (("Reference", reference), ("Value", value)):
+            text += '    (property "{}" {} (at 0 0 0) (layer "{}.SilkS")\n'.format(
+                name, Quote(property_value), side
+            )
+            text += "      (effects (font (size 1 1)))\n    )\n"
+    else:
+        for name, text_value in (("reference", reference), ("value", value)):
+            text += '    (fp_text {} {} (at 0 0) (layer "{}.SilkS")\n'.format(
+                name, Quote(text_value), side
+            )
+            text += "      (effects (font (size 1 1)))\n    )\n"
+        text += '    (fp_text user "${REFERENCE} (fab)" (at 0 0) (layer "F.Fab"))\n'
+    text += "    (attr smd{})\n".format(" exclude_from_pos_files" if excluded else "")
+    text += '    (pad "1" smd roundrect (at -0.775 0) (size 0.9 0.95) (layers "{}.Cu"))\n'.format(
+        side
+    )
+    return text + "  )\n"
+
+
+def WriteBoard(work_dir, version, padding):
+    """Write a board in the KiCad 5, 6 or 8+ format. Returns its file name"""
+    filename = os.path.join(work_dir, "check_v{}.kicad_pcb".format(version))
+    with open(filename, "w", encoding="utf-8") as f:
+        if version == 5:
+            f.write("(kicad_pcb (version 20171130) (host pcbnew 5.1.9)\n")
+        else:
+            f.write('(kicad_pcb (version 20240108) (generator "pcbnew")\n')
+        f.write("  (general\n    (thickness 1.6)\n  )\n")
+        f.write(Padding(padding))
+        for footprint in FOOTPRINTS:
+            f.write(Footprint(*footprint, version))
+        f.write(Padding(padding))
+        f.write(')\n')
+    return filename
+
+
+def WritePositions(filename):
+    """Write the CSV position file Pcbnew exports for the boards written by
+    WriteBoard.
+    """
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        out = csv.writer(f, lineterminator="\n")
+        out.writerow(["Ref", "Val", "Package", "PosX", "PosY", "Rot", "Side"])
+        rows = [footprint for footprint in FOOTPRINTS if not footprint[7]]
+        for reference, value, footprint, x, y, rotation, bottom, _ in sorted(
+            rows, key=lambda row: sexpr.NaturalKey(row[0])
+        ):
+            out.writerow(
+                [
+                    reference,
+                    value,
+                    footprint.split(":")[1],
+                    "{:.4f}".format(x),
+                    "{:.4f}".format(-y),
+                    "{:.6f}".format(rotation),
+                    "bottom" if bottom else "top",
+                ]
+            )
+
+
+def CheckSchematics(work_dir, paddings):
+    failures = []
+    # Components without part numbers are kept, so that none is left out
+    # unnoticed.
+    opts = BOMOptions(include_all_groups=True)
+    netlist_path = os.path.join(work_dir, "check.xml")
+    WriteNetlist(netlist_path)
+    expected = GenerateBOMRows(netlist_path, opts)
+    designators = ",".join(row[1] for row in expected[1:]).split(",")
+    if sorted(designators) != ["C1", "C10", "C20", "R1", "R10", "R11", "R2", "R20", "R21", "U1"]:
+        failures.append("netlist: BOM designators {!r}".format(designators))
+
+    for version in (6, 7):
+        for padding in paddings:
+            sheet_dir = os.path.join(work_dir, "v{}_{}".format(version, padding))
+            os.mkdir(sheet_dir)
+            root_path = WriteSchematic(sheet_dir, version, padding)
+            failures += Compare(
+                "schematic v{}, padding {}".format(version, padding),
+                lambda: GenerateBOMRows(root_path, opts),
+                expected,
+            )
+    return failures
+
+
+def CheckBoards(work_dir, paddings):
+    failures = []
+    db = ReadRotationRules([DB_PATH], use_cache=False)
+    positions_path = os.path.join(work_dir, "check-all-pos.csv")
+    WritePositions(positions_path)
+    expected = GenerateCPLRows(positions_path, db)
+    if len(expected) != 1 + sum(1 for footprint in FOOTPRINTS if not footprint[7]):
+        failures.append("positions: CPL {!r}".format(expected))
+
+    for version in (5, 6, 8):
+        for padding in paddings:
+            board_path = WriteBoard(work_dir, version, padding)
+            failures += Compare(
+                "board v{}, padding {}".format(version, padding),
+                lambda: GenerateCPLRows(board_path, db),
+                expected,
+            )
+    return failures
+
+
+def GetOpts():
+    parser = argparse.ArgumentParser(
+        description="Checks the KiCad schematic and board readers against the XML netlist "
+        "and CSV position file paths",
+    )
+    parser.add_argument(
+        "--paddings",
+        metavar="N",
+        type=int,
+        nargs="+",
+        default=[0, 150, 400, 1000],
+        help="Numbers of skipped items written around the symbols and footprints, so that "
+        "they straddle chunks at different places. Default: 0 150 400 1000",
+    )
+    return parser.parse_args()
+
+
+def main():
+    opts = GetOpts()
+    _LOGGER.SetLevel(0)
+
+    failures = CheckTokenizer()
+    with tempfile.TemporaryDirectory() as work_dir:
+        failures += CheckSchematics(work_dir, opts.paddings)
+        failures += CheckBoards(work_dir, opts.paddings)
+
+    for failure in failures:
+        print("FAILED {}".format(failure), file=sys.stderr)
+    if failures:
+        return 1
+    print("All reader checks passed", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,38 +20,71 @@
 import os
 import sys
 import argparse
+import concurrent.futures
+import cProfile
 import errno
+import fnmatch
+import hashlib
+import json
+import time
 
+from jlc_kicad_tools import __version__, timings
 from jlc_kicad_tools.logger import Log
-from jlc_kicad_tools.jlc_lib.cpl_fix_rotations import ReadDB, FixRotations
-from jlc_kicad_tools.jlc_lib.generate_bom import GenerateBOM
+from jlc_kicad_tools.jlc_lib.cpl_fix_rotations import (
+    CPL_BACKENDS,
+    ClearDBCache,
+    FixRotations,
+    FixVariantRotations,
+    ReadRotationRules,
+)
+from jlc_kicad_tools.jlc_lib.generate_bom import (
+    EXCLUSION_KEYS,
+    ExclusionError,
+    GenerateBOM,
+    LoadExclusions,
+    LoadNetlist,
+    MakeComponentFilter,
+    WriteBOM,
+    WriteVariantBOMs,
+)
+from jlc_kicad_tools.jlc_lib.kicad_netlist_reader import NETLIST_BACKENDS
+from jlc_kicad_tools.jlc_lib.kicad_pcb_reader import PCB_EXTENSION
+from jlc_kicad_tools.jlc_lib.kicad_sch_reader import (
+    SCHEMATIC_EXTENSION,
+    ListSchematicFiles,
+    SchematicError,
+)
+from jlc_kicad_tools.jlc_lib.panel import LoadPanel, PanelError
+from jlc_kicad_tools.jlc_lib.variants import LoadVariants, VariantError, VariantPath
 
 DEFAULT_DB_PATH = "cpl_rotations_db.csv"
 
+STAGE_EXECUTORS = ("serial", "thread", "process")
+
+# Directories never searched for project files: version control, KiCad
+# backups and caches. More patterns can be listed in IGNORE_FILENAME.
+DEFAULT_IGNORE_PATTERNS = [
+    ".git",
+    ".hg",
+    ".svn",
+    ".bzr",
+    "__pycache__",
+    "*-backups",
+    "backup",
+    "backups",
+]
+
+# File in the project directory listing additional glob patterns (one per
+# line) of directories and files to skip when searching for project files.
+IGNORE_FILENAME = ".jlcignore"
+
 _LOGGER = Log()
 
 
-def GetOpts():
-    parser = argparse.ArgumentParser(
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        description="Generates BOM and CPL in CSV fashion to be used in JLCPCB Assembly Service",
-        prog="jlc-kicad-tools",
-    )
-    parser.add_argument(
-        "project_dir",
-        metavar="INPUT_DIRECTORY",
-        type=os.path.abspath,
-        help="Directory of KiCad project. If the KiCad project name doesn't match the directory \
-        name, make use of the PROJECT_NAME argument.",
-    )
-    parser.add_argument(
-        "-n",
-        "--project_name",
-        metavar="PROJECT_NAME",
-        type=str,
-        help="The name of the KiCad project in case it doesn't match the directory name.",
-        default=None,
-    )
+def AddGenerationOptions(parser):
+    """Add the options shared by all commands, which control how the BOM and
+    CPL files are generated
+    """
     parser.add_argument(
         "-d",
         "--database",
@@ -61,6 +94,18 @@ def GetOpts():
         default=[os.path.join(os.path.dirname(__file__), DEFAULT_DB_PATH)],
         action="append",
     )
+    parser.add_argument(
+        "--no-db-cache",
+        help="Do not read or write the compiled database cache",
+        dest="no_db_cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--clear-db-cache",
+        help="Delete all compiled database cache files before running",
+        dest="clear_db_cache",
+        action="store_true",
+    )
     verbosity = parser.add_argument_group("verbosity arguments")
     verbosity.add_argument(
         "-v",
@@ -82,6 +127,120 @@ def GetOpts():
         action="store_true",
         dest="include_all_groups",
     )
+    parser.add_argument(
+        "--netlist-backend",
+        help="XML parser used to read the netlist. 'sax' is the reference implementation, "
+        "'expat' is faster. Default: sax",
+        choices=NETLIST_BACKENDS,
+        dest="netlist_backend",
+        default="sax",
+    )
+    parser.add_argument(
+        "--cpl-backend",
+        help="How the CPL is transformed: one row at a time (rows), or column by column "
+        "(columns), which is faster on large CPLs but reads the whole file first. Default: rows",
+        choices=CPL_BACKENDS,
+        dest="cpl_backend",
+        default="rows",
+    )
+    exclusions = parser.add_argument_group(
+        "exclusion arguments",
+        "Components left out of the BOM. Patterns are regular expressions matched against \
+        the start of the text.",
+    )
+    exclusions.add_argument(
+        "--exclude-ref",
+        metavar="PATTERN",
+        help="Exclude components whose reference matches PATTERN (may be specified more \
+        than once)",
+        dest="exclude_references",
+        action="append",
+        default=[],
+    )
+    exclusions.add_argument(
+        "--exclude-value",
+        metavar="PATTERN",
+        help="Exclude components whose value matches PATTERN (may be specified more than once)",
+        dest="exclude_values",
+        action="append",
+        default=[],
+    )
+    exclusions.add_argument(
+        "--exclude-footprint",
+        metavar="PATTERN",
+        help="Exclude components whose footprint matches PATTERN (may be specified more \
+        than once)",
+        dest="exclude_footprints",
+        action="append",
+        default=[],
+    )
+    exclusions.add_argument(
+        "--exclusions",
+        metavar="FILE",
+        type=os.path.abspath,
+        help="JSON file of exclusion rules, added to the ones given on the command line: \
+        lists of 'references', 'values' and 'footprints' patterns, and 'uninstalled' to \
+        exclude components whose Installed field is NU",
+    )
+    exclusions.add_argument(
+        "--default-exclusions",
+        help="Also apply the built-in exclusion rules: test points, mounting holes, solder \
+        bridges and uninstalled components",
+        dest="default_exclusions",
+        action="store_true",
+    )
+    parser.set_defaults(component_filter=None)
+
+
+def AddCommonOptions(parser, default_stage_executor):
+    """Add the options shared by the single project and batch commands"""
+    AddGenerationOptions(parser)
+    parser.add_argument(
+        "--max-depth",
+        metavar="N",
+        type=int,
+        default=None,
+        help="Search for project files at most N directory levels below the project directory. \
+        Default: no limit",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        help="Regenerate the output files even if the inputs haven't changed since the last run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stage-executor",
+        help="How BOM and CPL generation are run: one after the other (serial), or "
+        "concurrently in threads or processes. Default: {}".format(default_stage_executor),
+        choices=STAGE_EXECUTORS,
+        dest="stage_executor",
+        default=default_stage_executor,
+    )
+
+
+def GetOpts():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Generates BOM and CPL in CSV fashion to be used in JLCPCB Assembly Service",
+        prog="jlc-kicad-tools",
+    )
+    parser.add_argument(
+        "project_dir",
+        metavar="INPUT_DIRECTORY",
+        type=os.path.abspath,
+        help="Directory of KiCad project. If the KiCad project name doesn't match the directory \
+        name, make use of the PROJECT_NAME argument.",
+    )
+    parser.add_argument(
+        "-n",
+        "--project_name",
+        metavar="PROJECT_NAME",
+        type=str,
+        help="The name of the KiCad project in case it doesn't match the directory name.",
+        default=None,
+    )
+    AddCommonOptions(parser, "thread")
     parser.add_argument(
         "-o",
         "--output",
@@ -90,6 +249,69 @@ def GetOpts():
         type=os.path.abspath,
         help="Output directory. Default: INPUT_DIRECTORY",
     )
+    parser.add_argument(
+        "--netlist",
+        metavar="NETLIST",
+        dest="netlist_path",
+        type=os.path.abspath,
+        help="Path of the netlist file, or of the root .kicad_sch schematic. Skips searching \
+        the project directory for it.",
+    )
+    parser.add_argument(
+        "--panel",
+        metavar="PANEL",
+        type=os.path.abspath,
+        help="JSON description of a panel to replicate the CPL placements on. See \
+        jlc_kicad_tools/jlc_lib/panel.py for the format.",
+    )
+    parser.add_argument(
+        "--variants",
+        metavar="VARIANTS",
+        type=os.path.abspath,
+        help="JSON description of assembly variants. A BOM and CPL is written for each variant, \
+        named after it, from a single read of the netlist. See \
+        jlc_kicad_tools/jlc_lib/variants.py for the format.",
+    )
+    parser.add_argument(
+        "--cpl",
+        metavar="CPL",
+        dest="cpl_path",
+        type=os.path.abspath,
+        help="Path of the CPL file, or of the .kicad_pcb board. Skips searching the project \
+        directory for it.",
+    )
+    profiling = parser.add_argument_group("profiling arguments")
+    profiling.add_argument(
+        "--timings",
+        metavar="FILE",
+        help="Write wall and CPU time of each processing stage, and item counts, to FILE as JSON",
+    )
+    profiling.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Run under cProfile and dump the statistics to FILE (readable with pstats)",
+    )
+    watch = parser.add_argument_group("watch arguments")
+    watch.add_argument(
+        "-w",
+        "--watch",
+        help="Keep running, and regenerate the BOM or CPL whenever the netlist or CPL file changes",
+        action="store_true",
+    )
+    watch.add_argument(
+        "--watch-interval",
+        metavar="SECONDS",
+        type=float,
+        default=0.5,
+        help="How often input files are checked for changes. Default: 0.5",
+    )
+    watch.add_argument(
+        "--debounce",
+        metavar="SECONDS",
+        type=float,
+        default=1.0,
+        help="How long a changed input file must stay unchanged before it is processed. Default: 1.0",
+    )
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -98,55 +320,237 @@ def GetOpts():
     return parser.parse_args(sys.argv[1:])
 
 
-def main():
+def GetBatchOpts():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Generates JLCPCB BOM and CPL files for many KiCad projects at once",
+        prog="jlc-kicad-tools-batch",
+    )
+    parser.add_argument(
+        "project_dirs",
+        metavar="INPUT_DIRECTORY",
+        type=os.path.abspath,
+        nargs="*",
+        help="Directories of KiCad projects. Project names must match the directory names.",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        metavar="MANIFEST",
+        type=os.path.abspath,
+        help="File listing one project directory per line, optionally followed by the \
+        project name. Relative paths are relative to the manifest. Lines starting with '#' \
+        are ignored.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of projects processed in parallel. Default: number of CPUs",
+    )
+    # Projects already run in parallel, so don't spread each one further.
+    AddCommonOptions(parser, "serial")
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="OUTPUT_DIRECTORY",
+        dest="output_dir",
+        type=os.path.abspath,
+        help="Output directory. Files of each project are written to a sub-directory named \
+        after the project. Default: each project's INPUT_DIRECTORY",
+    )
+    parser.set_defaults(netlist_path=None, cpl_path=None, panel=None, variants=None)
 
-    opts = GetOpts()
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit()
 
-    _LOGGER.SetLevel(opts.verbose_count)
+    return parser.parse_args(sys.argv[1:])
+
+
+def GetComponentFilter(opts):
+    """Return the componentFilter of the exclusion rules given in opts, or
+    None if there are none. Raises ExclusionError if the rules are invalid,
+    and IOError if the exclusions file can't be read.
+    """
+    rules = {
+        "references": list(opts.exclude_references),
+        "values": list(opts.exclude_values),
+        "footprints": list(opts.exclude_footprints),
+        "uninstalled": False,
+    }
+    if opts.exclusions:
+        for key, value in LoadExclusions(opts.exclusions).items():
+            if key in EXCLUSION_KEYS:
+                rules[key] += value
+            else:
+                rules[key] = value
+    return MakeComponentFilter(defaults=opts.default_exclusions, **rules) or None
+
+
+@timings.Timed("db_load")
+def LoadDB(opts):
+    """Read all rotation databases in opts and compile them into rules"""
+    if opts.clear_db_cache:
+        ClearDBCache()
+
+    return ReadRotationRules(opts.database, not opts.no_db_cache)
 
-    if not os.path.isdir(opts.project_dir):
+
+def ReadIgnoreFile(project_dir):
+    """Return the patterns listed in the project's IGNORE_FILENAME, if any"""
+    patterns = []
+    try:
+        with open(os.path.join(project_dir, IGNORE_FILENAME), encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    patterns.append(line.rstrip("/"))
+    except FileNotFoundError:
+        pass
+    return patterns
+
+
+def _IsIgnored(name, relative_path, patterns):
+    for pattern in patterns:
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern):
+            return True
+    return False
+
+
+def FindProjectFiles(project_dir, filenames, max_depth=None, ignore_patterns=()):
+    """Return a dict mapping each name in filenames to the list of paths it
+    was found at. Files present directly in project_dir are taken from there
+    without searching further. Otherwise the directory tree is walked, at
+    most max_depth levels deep, skipping directories and files matching
+    ignore_patterns.
+    """
+    found = {}
+    missing = set()
+    for filename in filenames:
+        path = os.path.join(project_dir, filename)
+        if os.path.isfile(path):
+            found[filename] = [path]
+        else:
+            found[filename] = []
+            missing.add(filename)
+
+    if not missing:
+        return found
+
+    for dir_name, subdir_list, file_list in os.walk(project_dir):
+        relative_dir = os.path.relpath(dir_name, project_dir)
+        if relative_dir == ".":
+            relative_dir = ""
+            depth = 0
+        else:
+            relative_dir = relative_dir.replace(os.sep, "/")
+            depth = relative_dir.count("/") + 1
+
+        if max_depth is not None and depth >= max_depth:
+            subdir_list[:] = []
+        else:
+            subdir_list[:] = [
+                d
+                for d in subdir_list
+                if not _IsIgnored(d, relative_dir + "/" + d if relative_dir else d, ignore_patterns)
+            ]
+
+        if depth == 0:
+            # Already checked above.
+            continue
+
+        for file_name in file_list:
+            if file_name in missing and not _IsIgnored(
+                file_name, relative_dir + "/" + file_name, ignore_patterns
+            ):
+                found[file_name].append(os.path.join(dir_name, file_name))
+
+    return found
+
+
+@timings.Timed("discovery")
+def PrepareProject(project_dir, project_name, output_dir, opts):
+    """Find the input files of a project and create its output directory.
+    Returns (netlist_path, cpl_path, bom_output_path, cpl_output_path), or
+    None after logging the reason if the input files can't be found.
+    Netlist and CPL paths given in opts are used as-is.
+    """
+    if not os.path.isdir(project_dir):
         _LOGGER.logger.error(
-            "Failed to open project directory: {}".format(opts.project_dir)
+            "Failed to open project directory: {}".format(project_dir)
         )
-        return errno.ENOENT
+        return None
 
     # Set default output directory
-    if opts.output_dir is None:
-        opts.output_dir = opts.project_dir
+    if output_dir is None:
+        output_dir = project_dir
 
-    if not os.path.isdir(opts.output_dir):
-        _LOGGER.logger.info("Creating output directory {}".format(opts.output_dir))
-        os.mkdir(opts.output_dir)
+    if not os.path.isdir(output_dir):
+        _LOGGER.logger.info("Creating output directory {}".format(output_dir))
+        os.makedirs(output_dir, exist_ok=True)
 
-    if opts.project_name:
-        project_name = opts.project_name
-    else:
-        project_name = os.path.basename(opts.project_dir)
+    if not project_name:
+        project_name = os.path.basename(project_dir)
     _LOGGER.logger.debug("Project name is '%s'.", project_name)
 
     netlist_filename = project_name + ".xml"
     cpl_filename = project_name + "-all-pos.csv"
-    netlist_paths = []
-    cpl_paths = []
 
-    for dir_name, subdir_list, file_list in os.walk(opts.project_dir):
-        for file_name in file_list:
-            if file_name == netlist_filename:
-                netlist_paths.append(os.path.join(dir_name, file_name))
-            elif file_name == cpl_filename:
-                cpl_paths.append(os.path.join(dir_name, file_name))
+    for path in (opts.netlist_path, opts.cpl_path):
+        if path is not None and not os.path.isfile(path):
+            _LOGGER.logger.error("Failed to open file: {}".format(path))
+            return None
+
+    wanted = []
+    if opts.netlist_path is None:
+        wanted.append(netlist_filename)
+    if opts.cpl_path is None:
+        wanted.append(cpl_filename)
+
+    found = {}
+    if wanted:
+        found = FindProjectFiles(
+            project_dir,
+            wanted,
+            opts.max_depth,
+            DEFAULT_IGNORE_PATTERNS + ReadIgnoreFile(project_dir),
+        )
+    netlist_paths = found.get(netlist_filename, [opts.netlist_path])
+    cpl_paths = found.get(cpl_filename, [opts.cpl_path])
+
+    # Without exported files, read KiCad 6+ schematics and boards directly.
+    schematic_filename = project_name + SCHEMATIC_EXTENSION
+    board_filename = project_name + PCB_EXTENSION
+    wanted = []
+    if not netlist_paths:
+        wanted.append(schematic_filename)
+    if not cpl_paths:
+        wanted.append(board_filename)
+    if wanted:
+        found = FindProjectFiles(
+            project_dir,
+            wanted,
+            opts.max_depth,
+            DEFAULT_IGNORE_PATTERNS + ReadIgnoreFile(project_dir),
+        )
+        netlist_paths = netlist_paths or found[schematic_filename]
+        cpl_paths = cpl_paths or found[board_filename]
 
     if len(netlist_paths) < 1:
         _LOGGER.logger.error(
             (
-                f"Failed to find netlist file: {netlist_filename} in {opts.project_dir} (and sub-directories). "
+                f"Failed to find netlist file: {netlist_filename} or schematic: "
+                f"{schematic_filename} in {project_dir} (and sub-directories). "
                 "Is the input directory a KiCad project? "
                 "If so, run 'Tools -> Generate Bill of Materials' in Eeschema (any format). "
                 "It will generate an intermediate file we need. "
                 "Note that this is not the same as a netlist for Pcbnew."
             )
         )
-        return errno.ENOENT
+        return None
 
     if len(netlist_paths) > 1:
         _LOGGER.logger.error(
@@ -155,17 +559,18 @@ def main():
                 "There should be exactly one."
             )
         )
-        return errno.ENOENT
+        return None
 
     if len(cpl_paths) < 1:
         _LOGGER.logger.error(
             (
-                f"Failed to find CPL file: {cpl_filename} in {opts.project_dir} (and sub-directories). "
+                f"Failed to find CPL file: {cpl_filename} or board: {board_filename} "
+                f"in {project_dir} (and sub-directories). "
                 "Run 'File -> Fabrication Outputs -> Footprint Position (.pos) File' in Pcbnew. "
                 "Settings: 'CSV', 'mm', 'single file for board'."
             )
         )
-        return errno.ENOENT
+        return None
 
     if len(cpl_paths) > 1:
         _LOGGER.logger.error(
@@ -174,7 +579,7 @@ def main():
                 "There should be exactly one."
             )
         )
-        return errno.ENOENT
+        return None
 
     netlist_path = netlist_paths[0]
     cpl_path = cpl_paths[0]
@@ -182,21 +587,515 @@ def main():
     _LOGGER.logger.info("Netlist file found at: {}".format(netlist_path))
     _LOGGER.logger.info("CPL file found at: {}".format(cpl_path))
 
-    bom_output_path = os.path.join(opts.output_dir, project_name + "_bom_jlc.csv")
-    cpl_output_path = os.path.join(opts.output_dir, project_name + "_cpl_jlc.csv")
+    bom_output_path = os.path.join(output_dir, project_name + "_bom_jlc.csv")
+    cpl_output_path = os.path.join(output_dir, project_name + "_cpl_jlc.csv")
+
+    return netlist_path, cpl_path, bom_output_path, cpl_output_path
+
+
+def _HashFile(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def GetManifestInputs(netlist_path, cpl_path, opts):
+    """Return everything the output files of a project depend on: tool
+    version, options and exclusion rules that change the output, and the
+    content hashes of the netlist (or of every sheet of a schematic), CPL,
+    database, panel and variants files.
+    """
+    netlist = [netlist_path, _HashFile(netlist_path)]
+    if netlist_path.endswith(SCHEMATIC_EXTENSION):
+        try:
+            netlist = [[path, _HashFile(path)] for path in ListSchematicFiles(netlist_path)]
+        except SchematicError:
+            # Reported when the BOM is generated.
+            pass
+    inputs = {
+        "version": __version__,
+        "include_all_groups": opts.include_all_groups,
+        "netlist": netlist,
+        "cpl": [cpl_path, _HashFile(cpl_path)],
+        "databases": [[filename, _HashFile(filename)] for filename in opts.database],
+    }
+    if opts.panel:
+        inputs["panel"] = [opts.panel, _HashFile(opts.panel)]
+    if opts.component_filter:
+        inputs["exclusions"] = opts.component_filter.asDict()
+    if opts.variants:
+        inputs["variants"] = [opts.variants, _HashFile(opts.variants)]
+    return inputs
+
 
-    db = {}
-    for filename in opts.database:
-        db.update(ReadDB(filename))
-    if GenerateBOM(netlist_path, bom_output_path, opts) and FixRotations(
-        cpl_path, cpl_output_path, db
-    ):
+def IsUpToDate(manifest_path, inputs):
+    """Return True if the manifest written by the last run was made from the
+    same inputs, and its output files are still there unchanged.
+    """
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("inputs") != inputs:
+            return False
+        for path, sha256 in manifest["outputs"].items():
+            if _HashFile(path) != sha256:
+                return False
+    except (OSError, ValueError, KeyError, AttributeError):
+        return False
+    return True
+
+
+def WriteManifest(manifest_path, inputs, output_paths):
+    manifest = {
+        "inputs": inputs,
+        "outputs": {path: _HashFile(path) for path in output_paths},
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _CallStage(function, args):
+    # Exceptions are returned as text, since not all of them can be pickled
+    # back from a worker process.
+    try:
+        return function(*args), None
+    except Exception as e:
+        return False, repr(e)
+
+
+def RunStages(stages, executor):
+    """Run stages, a list of (name, function, args), either one after the
+    other or concurrently depending on executor (one of STAGE_EXECUTORS).
+    Every stage runs even if another one fails. Returns the names of the
+    stages that failed, after logging the exceptions raised.
+    """
+    if executor == "serial":
+        results = [_CallStage(function, args) for name, function, args in stages]
+    else:
+        if executor == "process":
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=len(stages))
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(stages))
+        with pool:
+            futures = [
+                pool.submit(_CallStage, function, args) for name, function, args in stages
+            ]
+            results = [future.result() for future in futures]
+
+    failed = []
+    for (name, function, args), (result, error) in zip(stages, results):
+        if error is not None:
+            _LOGGER.logger.error("{} generation raised: {}".format(name, error))
+        if not result:
+            failed.append(name)
+    return failed
+
+
+def GetVariantOutputPaths(output_path, variants):
+    return [VariantPath(output_path, variant.name) for variant in variants]
+
+
+def GetManifestPath(bom_output_path):
+    return bom_output_path[: -len("_bom_jlc.csv")] + "_jlc_manifest.json"
+
+
+def GetOutputPaths(bom_output_path, cpl_output_path, variants):
+    """Return the paths of all the output files of a project"""
+    if variants is None:
+        return [bom_output_path, cpl_output_path]
+    return GetVariantOutputPaths(bom_output_path, variants) + GetVariantOutputPaths(
+        cpl_output_path, variants
+    )
+
+
+def GetVariantExclusions(net, variants):
+    """Return a dict mapping the name of each of variants to the set of
+    (upper case) references of the components it doesn't place.
+    """
+    return {
+        variant.name: {
+            c.getRef().upper() for c in net.components if not variant.places(c)
+        }
+        for variant in variants
+    }
+
+
+def GenerateVariants(paths, db, panel, variants, opts):
+    """Write the BOM and CPL of each of variants, reading the netlist once.
+    paths are the paths returned by PrepareProject. Returns the names of the
+    stages that failed, after logging the reasons.
+    """
+    netlist_path, cpl_path, bom_output_path, cpl_output_path = paths
+    try:
+        net = LoadNetlist(netlist_path, opts)
+    except Exception as e:
+        _LOGGER.logger.error("BOM generation raised: {!r}".format(e))
+        # The CPLs can't be filtered without the netlist either.
+        return ["BOM", "CPL"]
+
+    failed = []
+    try:
+        if not WriteVariantBOMs(net, bom_output_path, opts, variants):
+            failed.append("BOM")
+    except Exception as e:
+        _LOGGER.logger.error("BOM generation raised: {!r}".format(e))
+        failed.append("BOM")
+    try:
+        if not FixVariantRotations(
+            cpl_path,
+            cpl_output_path,
+            db,
+            GetVariantExclusions(net, variants),
+            opts.cpl_backend,
+            panel,
+        ):
+            failed.append("CPL")
+    except Exception as e:
+        _LOGGER.logger.error("CPL generation raised: {!r}".format(e))
+        failed.append("CPL")
+    return failed
+
+
+def ProcessProject(project_dir, project_name, output_dir, opts, db=None):
+    """Generate the JLC BOM and CPL files of one project. Returns 0 on
+    success or an errno value. If db is None, the databases in opts are
+    loaded once the project's input files have been found.
+    """
+    paths = PrepareProject(project_dir, project_name, output_dir, opts)
+    if paths is None:
+        return errno.ENOENT
+    netlist_path, cpl_path, bom_output_path, cpl_output_path = paths
+
+    # The manifest records what the outputs were generated from, so that
+    # unchanged projects can be skipped.
+    manifest_path = GetManifestPath(bom_output_path)
+    manifest_inputs = GetManifestInputs(netlist_path, cpl_path, opts)
+    variants = LoadVariants(opts.variants) if opts.variants else None
+    output_paths = GetOutputPaths(bom_output_path, cpl_output_path, variants)
+    if not opts.force and IsUpToDate(manifest_path, manifest_inputs):
+        _LOGGER.logger.warning(
+            "{} and {} are up to date".format(", ".join(output_paths[:-1]), output_paths[-1])
+        )
+        return 0
+
+    if db is None:
+        db = LoadDB(opts)
+    panel = LoadPanel(opts.panel) if opts.panel else None
+
+    if variants is not None:
+        # The parsed netlist is shared by all variants, so the stages run
+        # here rather than in the stage executor.
+        failed = GenerateVariants(paths, db, panel, variants, opts)
+        if failed:
+            _LOGGER.logger.error("Failed to generate {}".format(" and ".join(failed)))
+            return errno.EINVAL
+        WriteManifest(manifest_path, manifest_inputs, output_paths)
+        return 0
+
+    failed = RunStages(
+        [
+            ("BOM", GenerateBOM, (netlist_path, bom_output_path, opts)),
+            (
+                "CPL",
+                FixRotations,
+                (cpl_path, cpl_output_path, db, opts.cpl_backend, panel),
+            ),
+        ],
+        opts.stage_executor,
+    )
+    if "BOM" not in failed:
         _LOGGER.logger.info("JLC BOM file written to: {}".format(bom_output_path))
+    if "CPL" not in failed:
         _LOGGER.logger.info("JLC CPL file written to: {}".format(cpl_output_path))
-    else:
+    if failed:
+        _LOGGER.logger.error("Failed to generate {}".format(" and ".join(failed)))
         return errno.EINVAL
+
+    WriteManifest(manifest_path, manifest_inputs, output_paths)
+    return 0
+
+
+def _FileStamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def WatchProject(project_dir, project_name, output_dir, opts):
+    """Generate the JLC BOM and CPL files of one project, then keep
+    regenerating each of them whenever its input file changes. The rotation
+    databases and the parsed netlist are kept in memory between runs, and the
+    manifest is updated whenever both files are up to date. Runs until
+    interrupted.
+    """
+    paths = PrepareProject(project_dir, project_name, output_dir, opts)
+    if paths is None:
+        return errno.ENOENT
+    netlist_path, cpl_path, bom_output_path, cpl_output_path = paths
+
+    db = LoadDB(opts)
+    net = None
+    variants = LoadVariants(opts.variants) if opts.variants else None
+    manifest_path = GetManifestPath(bom_output_path)
+    output_paths = GetOutputPaths(bom_output_path, cpl_output_path, variants)
+    # Stage name -> whether its output files are up to date
+    succeeded = {"BOM": False, "CPL": False}
+
+    def UpdateBOM():
+        nonlocal net
+        succeeded["BOM"] = False
+        loaded = net is not None
+        net = LoadNetlist(netlist_path, opts)
+        if variants is not None:
+            succeeded["BOM"] = WriteVariantBOMs(net, bom_output_path, opts, variants)
+            if loaded:
+                # Which placements each variant leaves out may have changed.
+                UpdateCPL()
+        elif WriteBOM(net, bom_output_path, opts):
+            succeeded["BOM"] = True
+            _LOGGER.logger.info("JLC BOM file written to: {}".format(bom_output_path))
+
+    def UpdateCPL():
+        succeeded["CPL"] = False
+        panel = LoadPanel(opts.panel) if opts.panel else None
+        if variants is not None:
+            if net is not None:
+                succeeded["CPL"] = FixVariantRotations(
+                    cpl_path,
+                    cpl_output_path,
+                    db,
+                    GetVariantExclusions(net, variants),
+                    opts.cpl_backend,
+                    panel,
+                )
+        elif FixRotations(cpl_path, cpl_output_path, db, opts.cpl_backend, panel):
+            succeeded["CPL"] = True
+            _LOGGER.logger.info("JLC CPL file written to: {}".format(cpl_output_path))
+
+    def Update(path):
+        # Failures are logged rather than raised, so that watching goes on
+        # while the project is being fixed.
+        try:
+            # Hashed before regenerating, so that a change made meanwhile
+            # makes the next run regenerate again.
+            inputs = GetManifestInputs(netlist_path, cpl_path, opts)
+            updaters[path]()
+        except Exception as e:
+            _LOGGER.logger.error("Failed to process {}: {}".format(path, e))
+            return
+        # Changes still waiting to be processed would leave the manifest
+        # claiming outputs newer than they are.
+        if not pending and all(succeeded.values()):
+            WriteManifest(manifest_path, inputs, output_paths)
+
+    updaters = {netlist_path: UpdateBOM, cpl_path: UpdateCPL}
+    if netlist_path.endswith(SCHEMATIC_EXTENSION):
+        # A change to any sheet of the hierarchy changes the BOM.
+        for path in ListSchematicFiles(netlist_path):
+            updaters.setdefault(path, UpdateBOM)
+    stamps = {}
+    # Path -> time of its last change that hasn't been processed yet
+    pending = {}
+
+    for path in updaters:
+        stamps[path] = _FileStamp(path)
+    # Sheets share the netlist's updater, which only needs to run once.
+    Update(netlist_path)
+    Update(cpl_path)
+
+    _LOGGER.logger.warning(
+        "Watching {} and {} for changes. Press Ctrl+C to stop.".format(
+            netlist_path, cpl_path
+        )
+    )
+
+    try:
+        while True:
+            time.sleep(opts.watch_interval)
+            now = time.monotonic()
+
+            for path in updaters:
+                stamp = _FileStamp(path)
+                if stamp != stamps[path]:
+                    stamps[path] = stamp
+                    pending[path] = now
+
+            # Editors often save in several steps, so wait for a changed file
+            # to settle before processing it.
+            for path, changed in list(pending.items()):
+                if now - changed < opts.debounce:
+                    continue
+                del pending[path]
+                if stamps[path] is None:
+                    _LOGGER.logger.warning("{} was removed, waiting for it to come back".format(path))
+                    continue
+                _LOGGER.logger.warning("{} changed, regenerating".format(path))
+                Update(path)
+    except KeyboardInterrupt:
+        pass
+
     return 0
 
 
+def main():
+
+    if sys.argv[1:2] == ["serve"]:
+        # Imported here since the server builds on this module.
+        from jlc_kicad_tools import serve
+
+        return serve.main(sys.argv[2:])
+
+    opts = GetOpts()
+
+    _LOGGER.SetLevel(opts.verbose_count)
+
+    if opts.panel:
+        try:
+            LoadPanel(opts.panel)
+        except (IOError, PanelError) as e:
+            _LOGGER.logger.error("Invalid panel description: {}".format(e))
+            return errno.EINVAL
+
+    if opts.variants:
+        try:
+            LoadVariants(opts.variants)
+        except (IOError, VariantError) as e:
+            _LOGGER.logger.error("Invalid variants description: {}".format(e))
+            return errno.EINVAL
+
+    try:
+        opts.component_filter = GetComponentFilter(opts)
+    except (IOError, ExclusionError) as e:
+        _LOGGER.logger.error("Invalid exclusion rules: {}".format(e))
+        return errno.EINVAL
+
+    if opts.timings:
+        timings.Start()
+        if opts.stage_executor == "process":
+            # Stages in other processes can't be timed from here.
+            _LOGGER.logger.warning("Running stages in threads to record timings")
+            opts.stage_executor = "thread"
+
+    profiler = None
+    if opts.profile:
+        # cProfile only sees the thread it was enabled in.
+        opts.stage_executor = "serial"
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        if opts.watch:
+            return WatchProject(opts.project_dir, opts.project_name, opts.output_dir, opts)
+
+        return ProcessProject(opts.project_dir, opts.project_name, opts.output_dir, opts)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(opts.profile)
+            _LOGGER.logger.info("Profile written to: {}".format(opts.profile))
+        if opts.timings:
+            with open(opts.timings, "w", encoding="utf-8") as f:
+                json.dump(timings.Stop().asDict(), f, indent=2)
+            _LOGGER.logger.info("Timings written to: {}".format(opts.timings))
+
+
+def ReadManifest(filename):
+    """Return (project_dir, project_name) pairs listed in a batch manifest"""
+    projects = []
+    base_dir = os.path.dirname(filename)
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split(None, 1)
+            project_dir = os.path.abspath(os.path.join(base_dir, parts[0]))
+            projects.append((project_dir, parts[1] if len(parts) > 1 else None))
+    return projects
+
+
+# Per-process state of batch workers, set up once by _InitBatchWorker.
+_BATCH_DB = None
+_BATCH_OPTS = None
+
+
+def _InitBatchWorker(db, opts):
+    global _BATCH_DB, _BATCH_OPTS
+    _BATCH_DB = db
+    _BATCH_OPTS = opts
+    _LOGGER.SetLevel(opts.verbose_count)
+
+
+def _RunBatchProject(project):
+    project_dir, project_name = project
+    opts = _BATCH_OPTS
+    output_dir = None
+    if opts.output_dir is not None:
+        output_dir = os.path.join(
+            opts.output_dir, project_name or os.path.basename(project_dir)
+        )
+    try:
+        return ProcessProject(project_dir, project_name, output_dir, opts, _BATCH_DB)
+    except Exception as e:
+        _LOGGER.logger.error("{}: {}".format(project_dir, e))
+        return errno.EINVAL
+
+
+def batch_main():
+
+    opts = GetBatchOpts()
+
+    _LOGGER.SetLevel(opts.verbose_count)
+
+    projects = [(project_dir, None) for project_dir in opts.project_dirs]
+    if opts.manifest:
+        try:
+            projects += ReadManifest(opts.manifest)
+        except IOError as e:
+            _LOGGER.logger.error("Failed to read manifest: {}".format(e))
+            return errno.ENOENT
+
+    if not projects:
+        _LOGGER.logger.error("No projects given")
+        return errno.EINVAL
+
+    try:
+        opts.component_filter = GetComponentFilter(opts)
+    except (IOError, ExclusionError) as e:
+        _LOGGER.logger.error("Invalid exclusion rules: {}".format(e))
+        return errno.EINVAL
+
+    # The databases are loaded and compiled once, and handed to each worker
+    # process when it starts.
+    db = LoadDB(opts)
+    jobs = max(1, min(opts.jobs, len(projects)))
+
+    if jobs == 1:
+        _InitBatchWorker(db, opts)
+        results = [_RunBatchProject(project) for project in projects]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_InitBatchWorker, initargs=(db, opts)
+        ) as executor:
+            results = list(executor.map(_RunBatchProject, projects))
+
+    failed = 0
+    for (project_dir, project_name), result in zip(projects, results):
+        if result == 0:
+            print("OK      {}".format(project_dir))
+        else:
+            print("FAILED  {} ({})".format(project_dir, os.strerror(result)))
+            failed += 1
+    print("{} projects, {} succeeded, {} failed".format(
+        len(projects), len(projects) - failed, failed
+    ))
+
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -15,11 +15,29 @@
 # You should have received a copy of the GNU General Public License
 # along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
 
+import array
+import collections
+import contextlib
 import csv
+import hashlib
+import json
+import logging
+import os
 import re
-from jlc_kicad_tools.logger import Log
+import tempfile
+import time
+from jlc_kicad_tools import __version__, timings
+from jlc_kicad_tools.jlc_lib import kicad_pcb_reader
+from jlc_kicad_tools.jlc_lib.streams import OpenOutput, OpenTextInput
+from jlc_kicad_tools.jlc_lib.variants import VariantPath
+from jlc_kicad_tools.logger import Log, TRACE
 from dataclasses import dataclass
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # JLC requires columns to be named a certain way.
 HEADER_REPLACEMENT_TABLE = {
     "Ref": "Designator",
@@ -29,6 +47,19 @@ HEADER_REPLACEMENT_TABLE = {
     "Side": "Layer",
 }
 
+# Bumped whenever the layout of compiled database cache files changes.
+DB_CACHE_FORMAT = 2
+
+# Characters that make a footprint pattern more than a plain literal.
+REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+# Ways of transforming a CPL: "rows" one row at a time, streaming, and
+# "columns" all rows at once, column by column, which is faster on large CPLs.
+CPL_BACKENDS = ("rows", "columns")
+
+# Number of values formatted at once by the columns backend.
+FORMAT_BATCH_SIZE = 4096
+
 _LOGGER = Log()
 
 
@@ -56,125 +87,698 @@ def ReadDB(filename):
     return db
 
 
-def FixRotations(input_filename, output_filename, db):
-    with open(input_filename, encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile, delimiter=",")
-        writer = csv.writer(open(output_filename, "w", newline=""), delimiter=",")
-        package_index = None
-        rotation_index = None
-        posx_index = None
-        posy_index = None
-        side_index = None
-        ref_index = None
-        for row in reader:
-            if not package_index:
-                # This is the first row. Find "Package" and "Rot" column indices.
-                for i in range(len(row)):
-                    if row[i] == "Package":
-                        package_index = i
-                    elif row[i] == "Rot":
-                        rotation_index = i
-                    elif row[i] == "PosX":
-                        posx_index = i
-                    elif row[i] == "PosY":
-                        posy_index = i
-                    elif row[i] == "Side":
-                        side_index = i
-                    elif row[i] == "Ref":
-                        ref_index = i
-                if package_index is None:
-                    _LOGGER.logger.warning(
-                        "Failed to find 'Package' column in the csv file"
-                    )
-                    return False
-                if rotation_index is None:
-                    _LOGGER.logger.warning(
-                        "Failed to find 'Rot' column in the csv file"
-                    )
-                    return False
-                if side_index is None:
-                    _LOGGER.logger.warning(
-                        "Failed to find 'Side' column in the csv file"
-                    )
-                    return False
-                if posx_index is None:
-                    _LOGGER.logger.warning(
-                        "Failed to find 'PosX' column in the csv file"
-                    )
-                    return False
-                if posy_index is None:
-                    _LOGGER.logger.warning(
-                        "Failed to find 'PosY' column in the csv file"
-                    )
-                    return False
-                if ref_index is None:
-                    _LOGGER.logger.warning(
-                        "Failed to find 'Ref' column in the csv file"
-                    )
-                    return False
+def _LiteralRule(text):
+    """Return (literal, exact) if the pattern text is a plain literal anchored
+    at the start ("^SOT-23"), and maybe also at the end ("^SOT-23$"), or None
+    if it needs the regex engine.
+    """
+    if text.startswith("^"):
+        text = text[1:]
+    exact = text.endswith("$")
+    if exact:
+        text = text[:-1]
+    if REGEX_METACHARACTERS.intersection(text):
+        return None
+    return text, exact
+
+
+class _LiteralPattern:
+    """Stands in for the compiled pattern of a literal rule loaded from the
+    database cache. RotationRules matches literal rules by table lookup, so
+    the pattern is only compiled if match() is called.
+    """
+
+    __slots__ = ("pattern", "_compiled")
+
+    # What re.compile() gives a pattern without metacharacters
+    flags = re.UNICODE
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self._compiled = None
+
+    def __eq__(self, other):
+        return type(other) is _LiteralPattern and other.pattern == self.pattern
+
+    def __hash__(self):
+        return hash(self.pattern)
+
+    def __repr__(self):
+        return "_LiteralPattern({!r})".format(self.pattern)
+
+    def match(self, text):
+        if self._compiled is None:
+            self._compiled = re.compile(self.pattern)
+        return self._compiled.match(text)
+
+
+def _CachedDB(rules):
+    """Build a database from the rules of a cache file, compiling only the
+    rules that aren't literals.
+    """
+    db = {}
+    for pattern, rotation, offset_x, offset_y, literal in rules:
+        key = _LiteralPattern(pattern) if literal else re.compile(pattern)
+        db[key] = DatabaseEntry(rotation=rotation, offset_x=offset_x, offset_y=offset_y)
+    return db
+
+
+def GetDBCacheDir():
+    """Return the default directory for compiled database cache files"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "jlc-kicad-tools")
+
+
+def _DBCachePath(filename, cache_dir):
+    path_hash = hashlib.sha256(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "db-{}.json".format(path_hash[:32]))
+
+
+def ReadDBCached(filename, cache_dir=None):
+    """Same as ReadDB, but goes through a compiled cache file in cache_dir.
+
+    The cache is keyed by the database's absolute path, size, mtime and
+    content hash, so it is rebuilt automatically when the CSV changes. If
+    size and mtime still match the cache is used without reading the CSV.
+    The cache records which rules are plain literals, which are then not
+    compiled (see RotationRules), so loading it only compiles the rules
+    that really are regular expressions.
+    """
+    if cache_dir is None:
+        cache_dir = GetDBCacheDir()
+
+    start = time.perf_counter()
+    cache_path = _DBCachePath(filename, cache_dir)
+    stat = os.stat(filename)
+
+    cached = None
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if (
+            cached.get("format") != DB_CACHE_FORMAT
+            or cached.get("version") != __version__
+            or cached.get("path") != os.path.abspath(filename)
+        ):
+            cached = None
+    except (OSError, ValueError):
+        cached = None
+
+    content_hash = None
+    if cached is not None and (
+        cached.get("size") != stat.st_size or cached.get("mtime_ns") != stat.st_mtime_ns
+    ):
+        # Touched or rewritten: only reuse the rules if the content is the same.
+        with open(filename, "rb") as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        if cached.get("sha256") != content_hash:
+            cached = None
+
+    if cached is not None:
+        rules = cached["rules"]
+        db = _CachedDB(rules)
+        _LOGGER.logger.info("Read {} rules from {}".format(len(db), filename))
+        if content_hash is not None:
+            _WriteDBCache(cache_path, filename, stat, content_hash, rules)
+        _LOGGER.logger.debug(
+            "Loaded {} from compiled cache in {:.2f} ms (warm)".format(
+                filename, (time.perf_counter() - start) * 1000
+            )
+        )
+        return db
+
+    rules = [
+        [
+            pattern.pattern,
+            entry.rotation,
+            entry.offset_x,
+            entry.offset_y,
+            _LiteralRule(pattern.pattern) is not None,
+        ]
+        for pattern, entry in ReadDB(filename).items()
+    ]
+    # Same keys as on a warm load, so that databases merge the same way.
+    db = _CachedDB(rules)
+    if content_hash is None:
+        with open(filename, "rb") as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+    _WriteDBCache(cache_path, filename, stat, content_hash, rules)
+    _LOGGER.logger.debug(
+        "Loaded {} and compiled cache in {:.2f} ms (cold)".format(
+            filename, (time.perf_counter() - start) * 1000
+        )
+    )
+    return db
+
+
+def _WriteDBCache(cache_path, filename, stat, content_hash, rules):
+    cached = {
+        "format": DB_CACHE_FORMAT,
+        "version": __version__,
+        "path": os.path.abspath(filename),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": content_hash,
+        # [pattern, rotation, offset_x, offset_y, literal]
+        "rules": rules,
+    }
+    cache_dir = os.path.dirname(cache_path)
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Each writer, in any thread or process, gets its own temporary file,
+        # so that a partly written cache is never published.
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=cache_dir,
+            prefix=os.path.basename(cache_path) + ".",
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            tmp_path = f.name
+            json.dump(cached, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        _LOGGER.logger.debug("Failed to write database cache {}: {}".format(cache_path, e))
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def ClearDBCache(cache_dir=None):
+    """Delete all compiled database cache files in cache_dir"""
+    if cache_dir is None:
+        cache_dir = GetDBCacheDir()
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.startswith("db-") and name.endswith(".json"):
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+    _LOGGER.logger.info("Removed {} cached databases from {}".format(removed, cache_dir))
+    return removed
+
+
+class RotationRules:
+    """Footprint rotation rules compiled for fast matching.
+
+    Built once from a database as returned by ReadDB (an ordered dict of
+    compiled pattern to DatabaseEntry). Like matching every pattern in order,
+    the last rule that matches a package wins. Rules that are plain literals
+    anchored at the start ("^SOT-23") or at both ends ("^SOT-23$") are looked
+    up in prefix and exact tables, and only the remaining rules are tried as
+    regular expressions.
+    """
+
+    def __init__(self, db):
+        self.rules = list(db.items())
+
+        # Literal text -> index of the last rule using it
+        self.exact = {}
+        self.prefixes = {}
+        # Distinct prefix lengths, to look up the prefixes of a package
+        self.prefix_lengths = []
+        # (index, pattern) of rules that need the regex engine, last first
+        self.regex_rules = []
+
+        for index, (pattern, entry) in enumerate(self.rules):
+            literal = _LiteralRule(pattern.pattern)
+            if literal is None or pattern.flags != re.UNICODE:
+                self.regex_rules.append((index, pattern))
+            elif literal[1]:
+                self.exact[literal[0]] = index
+            else:
+                self.prefixes[literal[0]] = index
+
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes})
+        self.regex_rules.reverse()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def matchIndex(self, package):
+        """Return the index of the last rule matching package, or None"""
+        # '$' also matches before a trailing newline
+        best = self.exact.get(package[:-1] if package.endswith("\n") else package)
+
+        for length in self.prefix_lengths:
+            if length > len(package):
+                break
+            index = self.prefixes.get(package[:length])
+            if index is not None and (best is None or index > best):
+                best = index
+
+        for index, pattern in self.regex_rules:
+            if best is not None and index < best:
+                break
+            if pattern.match(package):
+                best = index
+                break
+
+        return best
+
+    def match(self, package):
+        """Return (pattern, entry) of the last rule matching package, or
+        None if no rule matches.
+        """
+        index = self.matchIndex(package)
+        if index is None:
+            return None
+        return self.rules[index]
+
+
+def ReadRotationRules(filenames, use_cache=True):
+    """Read the databases in filenames, later ones taking precedence, and
+    compile them into RotationRules.
+    """
+    db = {}
+    for filename in filenames:
+        if use_cache:
+            db.update(ReadDBCached(filename))
+        else:
+            db.update(ReadDB(filename))
+    return RotationRules(db)
+
+
+class CPLError(Exception):
+    """Raised when a CPL file can't be converted"""
 
-                # Replace column names with labels JLC wants.
-                for i in range(len(row)):
-                    if row[i] in HEADER_REPLACEMENT_TABLE:
-                        row[i] = HEADER_REPLACEMENT_TABLE[row[i]]
+
+class _CPLColumns:
+    """Indices of the columns of a Pcbnew CPL that are transformed"""
+
+    __slots__ = ("ref", "package", "rotation", "posx", "posy", "side")
+
+    def __init__(self, header):
+        """Find the columns in header, and replace their names with the labels
+        JLC wants. Raises CPLError if a column is missing.
+        """
+        # In the order missing columns are reported
+        names = dict.fromkeys(("Package", "Rot", "Side", "PosX", "PosY", "Ref"))
+        for i in range(len(header)):
+            if header[i] in names:
+                names[header[i]] = i
+        for name, index in names.items():
+            if index is None:
+                raise CPLError("Failed to find '{}' column in the csv file".format(name))
+        self.ref = names["Ref"]
+        self.package = names["Package"]
+        self.rotation = names["Rot"]
+        self.posx = names["PosX"]
+        self.posy = names["PosY"]
+        self.side = names["Side"]
+
+        for i in range(len(header)):
+            if header[i] in HEADER_REPLACEMENT_TABLE:
+                header[i] = HEADER_REPLACEMENT_TABLE[header[i]]
+
+
+def _LogCPLStatistics(rows, flips, packages, cache_hits, rules_applied):
+    timings.Count("cpl_rows_transformed", rows)
+    if _LOGGER.logger.isEnabledFor(logging.INFO):
+        _LOGGER.logger.info(
+            "Processed %d CPL rows: %d bottom-side X flips, %d distinct packages "
+            "(%d rule cache hits), rules applied: %s",
+            rows,
+            flips,
+            packages,
+            cache_hits,
+            ", ".join(
+                "{} x{}".format(pattern, count) for pattern, count in rules_applied.items()
+            )
+            or "none",
+        )
+
+
+def TransformCPLRows(reader, db, panel=None):
+    """Yield the JLC version of each row (header first) read from a Pcbnew
+    CPL reader. With a panel, each row is yielded once per panel instance,
+    placed on that instance. Raises CPLError if a required column is missing.
+    """
+    if not isinstance(db, RotationRules):
+        db = RotationRules(db)
+
+    columns = None
+
+    # Package -> matched rule (or None). Boards have far fewer distinct
+    # packages than placements, so each package is resolved only once.
+    rule_cache = {}
+    cache_hits = 0
+
+    # Run statistics, reported once at the end
+    rows = 0
+    flips = 0
+    rules_applied = {}
+    trace = _LOGGER.logger.isEnabledFor(TRACE)
+
+    for row in reader:
+        if columns is None:
+            # This is the first row.
+            columns = _CPLColumns(row)
+            rotation_index = columns.rotation
+            posx_index = columns.posx
+            posy_index = columns.posy
+            side_index = columns.side
+            ref_index = columns.ref
+            package_index = columns.package
+        else:
+            rows += 1
+            rotation = float(row[rotation_index])
+            posx = float(row[posx_index])
+            posy = float(row[posy_index])
+            bottom = row[side_index].strip() == "bottom"
+
+            # JLC expects positions on the bottom to have positive X.
+            # Very old KiCad versions export with positive X. Less old KiCad versions export
+            # with negative X. New KiCad versions (>5.1.7) have a checkbox to support both.
+            # We auto-detect here so we can support both.
+            flip_x = bottom and posx < 0.0
+            if flip_x:
+                posx = -posx
+                flips += 1
+
+            row[ref_index] = row[ref_index].upper()
+            last_entry = None
+            last_pattern = None
+
+            package = row[package_index]
+            if package in rule_cache:
+                rule = rule_cache[package]
+                cache_hits += 1
             else:
-                rotation = float(row[rotation_index])
-                posx = float(row[posx_index])
-                posy = float(row[posy_index])
-
-                # JLC expects positions on the bottom to have positive X.
-                # Very old KiCad versions export with positive X. Less old KiCad versions export
-                # with negative X. New KiCad versions (>5.1.7) have a checkbox to support both.
-                # We auto-detect here so we can support both.
-                flip_x = (
-                    row[side_index].strip() == "bottom" and float(row[posx_index]) < 0.0
+                rule = rule_cache[package] = db.match(package)
+            if rule is not None:
+                last_pattern, last_entry = rule
+
+            if last_entry is not None:
+                if bottom:
+                    # This difference in how to apply corrections is specific to KiCad,
+                    # because if you were to look at the component, then:
+                    #  * when the component is on the top layer, a counter-clockwise rotation
+                    #    of the component would result in a positive addition to the generated
+                    #    rotation value
+                    #  * when the component is on the bottom layer, then a counter-clockwise
+                    #    rotation would result in a substraction from the generated rotation
+                    #    value.
+                    # This adjustment is independent of how JLCPCB treats bottom-layer rotations.
+                    rotation = (rotation - last_entry.rotation) % 360
+                else:
+                    rotation = (rotation + last_entry.rotation) % 360
+
+                rules_applied[last_pattern.pattern] = (
+                    rules_applied.get(last_pattern.pattern, 0) + 1
                 )
-                if flip_x:
-                    posx = -posx
-
-                row[ref_index] = row[ref_index].upper()
-                last_entry = None
-                last_pattern = None
-
-                for pattern, entry in db.items():
-                    if pattern.match(row[package_index]):
-                        last_entry = entry
-                        last_pattern = pattern
-
-                del entry
-                del pattern
-
-                if last_entry is not None:
-                    if row[side_index].strip() == "bottom":
-                        # This difference in how to apply corrections is specific to KiCad,
-                        # because if you were to look at the component, then:
-                        #  * when the component is on the top layer, a counter-clockwise rotation
-                        #    of the component would result in a positive addition to the generated
-                        #    rotation value
-                        #  * when the component is on the bottom layer, then a counter-clockwise
-                        #    rotation would result in a substraction from the generated rotation
-                        #    value.
-                        # This adjustment is independent of how JLCPCB treats bottom-layer rotations.
-                        rotation = (rotation - last_entry.rotation) % 360
-                    else:
-                        rotation = (rotation + last_entry.rotation) % 360
-
-                    _LOGGER.logger.info(f"Footprint {row[package_index]} matched {last_pattern.pattern}. Applying {last_entry.rotation} deg rotation and {last_entry.offset_x} mm, {last_entry.offset_y} mm offset correction.")
-                    posx += last_entry.offset_x
-                    posy += last_entry.offset_y
-
-                if row[side_index].strip() == "bottom":
-                    # This adjustment is specific to how JLCPCB treats bottom-layer rotations compared to
-                    # KiCad, and has historically changed many times:
-                    #  (note: when the change was noticed does not necessarily correspond with when JLCPCB changed behaviour)
-                    # Around 2020 August: rotation = rotation # no change
-                    # Around 2022 February: rotation = (rotation + 180) % 360
-                    # Around 2022 July: rotation = (-rotation + 180) % 360
-                    rotation = (-rotation + 180) % 360
-
-                row[rotation_index] = "{0:.6f}".format(rotation)
-                row[posx_index] = "{0:.6f}".format(posx)
-                row[posy_index] = "{0:.6f}".format(posy)
-
-            writer.writerow(row)
+                if trace:
+                    _LOGGER.logger.log(
+                        TRACE,
+                        "Footprint %s matched %s. Applying %s deg rotation and %s mm, %s mm offset correction.",
+                        package,
+                        last_pattern.pattern,
+                        last_entry.rotation,
+                        last_entry.offset_x,
+                        last_entry.offset_y,
+                    )
+                posx += last_entry.offset_x
+                posy += last_entry.offset_y
+
+            if bottom:
+                # This adjustment is specific to how JLCPCB treats bottom-layer rotations compared to
+                # KiCad, and has historically changed many times:
+                #  (note: when the change was noticed does not necessarily correspond with when JLCPCB changed behaviour)
+                # Around 2020 August: rotation = rotation # no change
+                # Around 2022 February: rotation = (rotation + 180) % 360
+                # Around 2022 July: rotation = (-rotation + 180) % 360
+                rotation = (-rotation + 180) % 360
+
+            if panel is not None:
+                ref = row[ref_index]
+                for instance in panel.instances:
+                    x, y, r = instance.place(posx, posy, rotation, bottom)
+                    row[ref_index] = ref + instance.suffix
+                    row[rotation_index] = "{0:.6f}".format(r)
+                    row[posx_index] = "{0:.6f}".format(x)
+                    row[posy_index] = "{0:.6f}".format(y)
+                    yield list(row)
+                continue
+
+            row[rotation_index] = "{0:.6f}".format(rotation)
+            row[posx_index] = "{0:.6f}".format(posx)
+            row[posy_index] = "{0:.6f}".format(posy)
+
+        yield row
+
+    _LogCPLStatistics(rows, flips, len(rule_cache), cache_hits, rules_applied)
+    if panel is not None:
+        _LOGGER.logger.info(
+            "Replicated %d CPL rows on %d panel instances", rows, len(panel)
+        )
+
+
+def TransformCPLColumns(reader, db):
+    """Column-oriented equivalent of TransformCPLRows, for large CPLs. The
+    numeric columns are converted and transformed as whole arrays, with NumPy
+    if it is installed, and formatted in batches. Returns the list of rows,
+    header first, which is identical to what TransformCPLRows yields.
+    """
+    if _LOGGER.logger.isEnabledFor(TRACE):
+        # Per-row logging needs the per-row path.
+        return list(TransformCPLRows(reader, db))
+    if not isinstance(db, RotationRules):
+        db = RotationRules(db)
+
+    rows = list(reader)
+    if not rows:
+        return rows
+    columns = _CPLColumns(rows[0])
+    body = rows[1:]
+
+    # Rules are matched once per distinct package, in order of appearance,
+    # and referred to by index from the per-row rule column. Index 0 is for
+    # packages without a rule.
+    packages = [row[columns.package] for row in body]
+    rule_of_package = {}
+    rules = [None]
+    for package in dict.fromkeys(packages):
+        rule = db.match(package)
+        if rule is None:
+            rule_of_package[package] = 0
+        else:
+            rule_of_package[package] = len(rules)
+            rules.append(rule)
+    rule_column = [rule_of_package[package] for package in packages]
+    corrections = [0.0] + [entry.rotation for pattern, entry in rules[1:]]
+    offsets_x = [0.0] + [entry.offset_x for pattern, entry in rules[1:]]
+    offsets_y = [0.0] + [entry.offset_y for pattern, entry in rules[1:]]
+
+    rotation = [float(row[columns.rotation]) for row in body]
+    posx = [float(row[columns.posx]) for row in body]
+    posy = [float(row[columns.posy]) for row in body]
+    bottom = [row[columns.side].strip() == "bottom" for row in body]
+
+    if numpy is not None:
+        transform = _TransformColumnsNumPy
+    else:
+        transform = _TransformColumnsArray
+    rotation, posx, posy, flips = transform(
+        rotation, posx, posy, bottom, rule_column, corrections, offsets_x, offsets_y
+    )
+
+    ref_index = columns.ref
+    rotation_index = columns.rotation
+    posx_index = columns.posx
+    posy_index = columns.posy
+    for row, r, x, y in zip(
+        body, _FormatColumn(rotation), _FormatColumn(posx), _FormatColumn(posy)
+    ):
+        row[ref_index] = row[ref_index].upper()
+        row[rotation_index] = r
+        row[posx_index] = x
+        row[posy_index] = y
+
+    rule_counts = collections.Counter(rule_column)
+    rules_applied = {}
+    for index in range(1, len(rules)):
+        pattern = rules[index][0].pattern
+        rules_applied[pattern] = rules_applied.get(pattern, 0) + rule_counts[index]
+    _LogCPLStatistics(
+        len(body), flips, len(rule_of_package), len(body) - len(rule_of_package), rules_applied
+    )
+    return rows
+
+
+# The transforms below are the ones of TransformCPLRows, applied to columns.
+# See there for why each is needed.
+
+
+def _TransformColumnsNumPy(
+    rotation, posx, posy, bottom, rule_column, corrections, offsets_x, offsets_y
+):
+    rotation = numpy.array(rotation, dtype=numpy.float64)
+    posx = numpy.array(posx, dtype=numpy.float64)
+    posy = numpy.array(posy, dtype=numpy.float64)
+    bottom = numpy.array(bottom, dtype=bool)
+    rule_column = numpy.array(rule_column, dtype=numpy.intp)
+    matched = rule_column != 0
+
+    # numpy.mod has the same semantics as Python's float %. NaN and infinite
+    # inputs give NaN, as in Python, without warnings.
+    with numpy.errstate(invalid="ignore"):
+        flip = bottom & (posx < 0.0)
+        posx = numpy.where(flip, -posx, posx)
+
+        correction = numpy.array(corrections, dtype=numpy.float64)[rule_column]
+        rotation = numpy.where(
+            matched,
+            numpy.where(
+                bottom,
+                numpy.mod(rotation - correction, 360),
+                numpy.mod(rotation + correction, 360),
+            ),
+            rotation,
+        )
+        posx = numpy.where(
+            matched, posx + numpy.array(offsets_x, dtype=numpy.float64)[rule_column], posx
+        )
+        posy = numpy.where(
+            matched, posy + numpy.array(offsets_y, dtype=numpy.float64)[rule_column], posy
+        )
+
+        rotation = numpy.where(bottom, numpy.mod(-rotation + 180, 360), rotation)
+
+    return rotation.tolist(), posx.tolist(), posy.tolist(), int(flip.sum())
+
+
+def _TransformColumnsArray(
+    rotation, posx, posy, bottom, rule_column, corrections, offsets_x, offsets_y
+):
+    flip = [b and x < 0.0 for b, x in zip(bottom, posx)]
+    posx = array.array("d", [-x if f else x for x, f in zip(posx, flip)])
+
+    rotation = array.array(
+        "d",
+        [
+            ((r - corrections[i]) % 360 if b else (r + corrections[i]) % 360) if i else r
+            for r, b, i in zip(rotation, bottom, rule_column)
+        ],
+    )
+    posx = array.array("d", [x + offsets_x[i] if i else x for x, i in zip(posx, rule_column)])
+    posy = array.array("d", [y + offsets_y[i] if i else y for y, i in zip(posy, rule_column)])
+
+    rotation = array.array(
+        "d", [(-r + 180) % 360 if b else r for r, b in zip(rotation, bottom)]
+    )
+
+    return rotation, posx, posy, sum(flip)
+
+
+def _FormatColumn(values):
+    """Format values as "{0:.6f}" does, a batch at a time"""
+    formatted = []
+    for start in range(0, len(values), FORMAT_BATCH_SIZE):
+        batch = tuple(values[start:start + FORMAT_BATCH_SIZE])
+        formatted += ("%.6f\n" * len(batch) % batch).split("\n")[:-1]
+    return formatted
+
+
+def TransformCPL(reader, db, backend="rows", panel=None):
+    """Return the JLC rows, header first, of the rows of a Pcbnew CPL reader,
+    transformed with backend, one of CPL_BACKENDS, and replicated on panel if
+    given. Rows are transformed lazily by the "rows" backend.
+    """
+    if backend not in CPL_BACKENDS:
+        raise ValueError("Unknown CPL backend: {}".format(backend))
+    if panel is not None:
+        # Panels multiply the number of rows, so they are always streamed.
+        return TransformCPLRows(reader, db, panel)
+    if backend == "columns":
+        return TransformCPLColumns(reader, db)
+    return TransformCPLRows(reader, db)
+
+
+@contextlib.contextmanager
+def _OpenCPL(source):
+    """Return a reader of the rows of the Pcbnew CPL in source. A .kicad_pcb
+    file name is read as a board instead.
+    """
+    if isinstance(source, str) and source.endswith(kicad_pcb_reader.PCB_EXTENSION):
+        yield kicad_pcb_reader.ReadFootprintRows(source)
+        return
+    with OpenTextInput(source) as csvfile:
+        yield csv.reader(csvfile, delimiter=",")
+
+
+@timings.Timed("cpl_transform")
+def GenerateCPLRows(source, db, backend="rows", panel=None):
+    """Return the JLC CPL rows, header first, of the Pcbnew CPL in source (a
+    file name, bytes or file-like object, or a .kicad_pcb board file
+    name), replicated on panel if given. Raises CPLError on failure.
+    """
+    with _OpenCPL(source) as reader:
+        return list(TransformCPL(reader, db, backend, panel))
+
+
+def FixRotations(input_filename, output_filename, db, backend="rows", panel=None):
+    """Convert a Pcbnew CPL to the JLC format, replicated on every board of
+    panel if given. Input and output may be file names or streams. Returns
+    False after logging the reason on failure.
+    """
+    try:
+        WriteCPL(input_filename, output_filename, db, backend, panel)
+    except CPLError as e:
+        _LOGGER.logger.warning("%s", e)
+        return False
     return True
+
+
+@timings.Timed("cpl_transform")
+def WriteCPL(source, output, db, backend="rows", panel=None):
+    """Convert the Pcbnew CPL in source (see GenerateCPLRows) and write it to
+    output, a file name or a text stream. Raises CPLError on failure.
+    """
+    with _OpenCPL(source) as reader, OpenOutput(output, newline="") as out:
+        writer = csv.writer(out, delimiter=",")
+        writer.writerows(TransformCPL(reader, db, backend, panel))
+
+
+def FixVariantRotations(input_filename, output_filename, db, excluded, backend="rows", panel=None):
+    """Convert a Pcbnew CPL to the JLC format once per variant, see
+    WriteVariantCPLs. Returns False after logging the reason on failure.
+    """
+    try:
+        WriteVariantCPLs(input_filename, output_filename, db, excluded, backend, panel)
+    except CPLError as e:
+        _LOGGER.logger.warning("%s", e)
+        return False
+    return True
+
+
+@timings.Timed("cpl_transform")
+def WriteVariantCPLs(source, output_filename, db, excluded, backend="rows", panel=None):
+    """Read the Pcbnew CPL in source (see GenerateCPLRows) once, and write
+    the CPL of each variant to output_filename with the variant name
+    appended (see variants.VariantPath). excluded maps the variant names to
+    the sets of (upper case) references left out of their CPL. Raises
+    CPLError on failure.
+    """
+    with _OpenCPL(source) as reader:
+        rows = list(reader)
+    ref_index = _CPLColumns(list(rows[0])).ref if rows else None
+
+    for name, refs in excluded.items():
+        # Rows are converted in place, so each variant gets copies.
+        variant_rows = [list(row) for row in rows[:1]]
+        variant_rows += [list(row) for row in rows[1:] if row[ref_index].upper() not in refs]
+        output = VariantPath(output_filename, name)
+        with OpenOutput(output, newline="") as out:
+            writer = csv.writer(out, delimiter=",")
+            writer.writerows(TransformCPL(iter(variant_rows), db, backend, panel))
+        _LOGGER.logger.info(
+            "Variant %s CPL written to: %s (%d placements left out)",
+            name,
+            output,
+            len(rows) - len(variant_rows),
+        )
@@ -16,36 +16,179 @@
 # You should have received a copy of the GNU General Public License
 # along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
 
-from jlc_kicad_tools.jlc_lib import kicad_netlist_reader
+from jlc_kicad_tools.jlc_lib import kicad_netlist_reader, kicad_sch_reader
+from jlc_kicad_tools.jlc_lib.streams import OpenOutput
+from jlc_kicad_tools.jlc_lib.variants import VariantPath
 import csv
+import json
 import re
+import xml.parsers.expat as expat
+import xml.sax as sax
+from dataclasses import dataclass
+from jlc_kicad_tools import timings
 from jlc_kicad_tools.logger import Log
 
 _LOGGER = Log()
 
 LCSC_PART_NUMBER_MATCHER = re.compile("^C[0-9]+$")
 
+# Netlist sections needed to generate the BOM. Everything else (notably the
+# nets, usually the largest part of the file) is skipped while parsing.
+BOM_NETLIST_SECTIONS = ("components", "libparts")
 
-def GenerateBOM(input_filename, output_filename, opts):
-    net = kicad_netlist_reader.netlist(input_filename)
+BOM_HEADER = ["Comment", "Designator", "Footprint", "LCSC Part Number"]
 
-    try:
-        f = open(output_filename, mode="w", encoding="utf-8")
-    except IOError:
-        _LOGGER.logger.error(
-            "Failed to open file for writing: {}".format(output_filename)
+# Raised by LoadNetlist for netlists that can't be read or parsed
+NETLIST_ERRORS = (
+    IOError,
+    sax.SAXParseException,
+    expat.ExpatError,
+    kicad_sch_reader.SchematicError,
+)
+
+# Pattern lists of an exclusions description, see LoadExclusions
+EXCLUSION_KEYS = ("references", "values", "footprints")
+
+
+class BOMError(Exception):
+    """Raised when a BOM can't be generated from a netlist"""
+
+
+class ExclusionError(Exception):
+    """Raised when exclusion rules are invalid"""
+
+
+@dataclass
+class BOMOptions:
+    """BOM generation options, for library users. The command line options
+    have the same attributes and can be used instead.
+    """
+
+    warn_no_partnumber: bool = False
+    include_all_groups: bool = False
+    netlist_backend: str = "sax"
+    # kicad_netlist_reader.componentFilter of the components left out of
+    # the BOM, see MakeComponentFilter. None keeps all of them.
+    component_filter: object = None
+
+
+def MakeComponentFilter(
+    references=(), values=(), footprints=(), uninstalled=False, defaults=False
+):
+    """Return a kicad_netlist_reader.componentFilter excluding components
+    whose reference, value or footprint starts with a match of one of the
+    given regular expressions, and with uninstalled, those whose "Installed"
+    field is "NU". With defaults, the built-in rules of kicad_netlist_reader
+    apply too. Raises ExclusionError if a pattern is invalid.
+    """
+    if defaults:
+        references = kicad_netlist_reader.excluded_references + list(references)
+        values = kicad_netlist_reader.excluded_values + list(values)
+        footprints = kicad_netlist_reader.excluded_footprints + list(footprints)
+        uninstalled = True
+    for pattern in [*references, *values, *footprints]:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ExclusionError("Invalid exclusion pattern {!r}: {}".format(pattern, e))
+    return kicad_netlist_reader.componentFilter(references, values, footprints, uninstalled)
+
+
+def LoadExclusions(filename):
+    """Read a JSON exclusions description, e.g.
+
+        {"references": ["TP[0-9]+"], "values": ["DNP"],
+         "footprints": ["MountingHole:"], "uninstalled": true}
+
+    and return it as a dict of MakeComponentFilter keyword arguments, every
+    key being optional. Raises ExclusionError if it is invalid, and IOError
+    if it can't be read.
+    """
+    with open(filename, encoding="utf-8") as f:
+        try:
+            description = json.load(f)
+        except ValueError as e:
+            raise ExclusionError("{}: {}".format(filename, e))
+    if not isinstance(description, dict):
+        raise ExclusionError("{}: exclusions description is not an object".format(filename))
+
+    rules = {}
+    for key, value in description.items():
+        if key in EXCLUSION_KEYS:
+            if not isinstance(value, list) or not all(isinstance(p, str) for p in value):
+                raise ExclusionError("{}: '{}' is not a list of strings".format(filename, key))
+        elif key == "uninstalled":
+            if not isinstance(value, bool):
+                raise ExclusionError("{}: 'uninstalled' is not true or false".format(filename))
+        else:
+            raise ExclusionError("{}: unknown key '{}'".format(filename, key))
+        rules[key] = value
+    return rules
+
+
+def LoadNetlist(source, opts):
+    """Parse the parts of a netlist needed to generate the BOM, leaving out
+    the components excluded by opts.component_filter. source may be a file
+    name, the netlist as bytes, or a file-like object. A .kicad_sch
+    file name is read as a schematic hierarchy instead. Raises one of
+    NETLIST_ERRORS if the netlist can't be read.
+    """
+    if isinstance(source, str) and source.endswith(kicad_sch_reader.SCHEMATIC_EXTENSION):
+        return kicad_sch_reader.ReadSchematic(
+            source,
+            sections=BOM_NETLIST_SECTIONS,
+            compact=True,
+            component_filter=opts.component_filter,
         )
+    return kicad_netlist_reader.netlist(
+        source,
+        sections=BOM_NETLIST_SECTIONS,
+        backend=opts.netlist_backend,
+        compact=True,
+        component_filter=opts.component_filter,
+    )
+
+
+def GenerateBOM(input_filename, output_filename, opts, variants=None):
+    """Write the BOM of the netlist in input_filename to output_filename.
+    With variants, a list of variants.Variant, the netlist is parsed once
+    and the BOM of each variant is written instead, see WriteVariantBOMs.
+    Returns False after logging the reason on failure.
+    """
+    try:
+        net = LoadNetlist(input_filename, opts)
+    except NETLIST_ERRORS as e:
+        _LOGGER.logger.error("Failed to read the netlist: {}".format(e))
         return False
+    if variants is not None:
+        return WriteVariantBOMs(net, output_filename, opts, variants)
+    return WriteBOM(net, output_filename, opts)
 
-    out = csv.writer(
-        f, lineterminator="\n", delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL
-    )
 
-    out.writerow(["Comment", "Designator", "Footprint", "LCSC Part Number"])
+def GenerateBOMRows(source, opts=None):
+    """Return the BOM rows, header first, of the netlist in source (a file
+    name, bytes or file-like object). Raises BOMError or the parser's
+    exceptions on failure.
+    """
+    if opts is None:
+        opts = BOMOptions()
+    return GetBOMRows(LoadNetlist(source, opts), opts)
+
 
-    grouped = net.groupComponents()
+def GetBOMRows(net, opts, components=None):
+    """Return the BOM rows, header first, of an already loaded netlist, or of
+    the given subset of its components. Raises BOMError if a component group
+    has no or several footprints.
+    """
+    rows = [BOM_HEADER]
+
+    if components is not None and not components:
+        # An empty subset, e.g. a variant placing nothing, has no groups,
+        # where groupComponents() would group every component.
+        grouped = []
+    else:
+        grouped = net.groupComponents(components)
 
-    num_groups_found = 0
     for group in grouped:
         refs = []
         lcsc_part_number = None
@@ -63,7 +206,7 @@ def GenerateBOM(input_filename, output_filename, opts):
         if lcsc_part_number is None:
             if opts.warn_no_partnumber:
                 _LOGGER.logger.warning(
-                    "No LCSC part number found for components {}".format(",".join(refs))
+                    "No LCSC part number found for components %s", ",".join(refs)
                 )
             if not opts.include_all_groups:
                 continue
@@ -71,29 +214,72 @@ def GenerateBOM(input_filename, output_filename, opts):
 
         # Check footprints for uniqueness
         if len(footprints) == 0:
-            _LOGGER.logger.error(
-                "No footprint found for components {}".format(",".join(refs))
-            )
-            return False
+            raise BOMError("No footprint found for components {}".format(",".join(refs)))
         if len(footprints) != 1:
-            _LOGGER.logger.error(
+            raise BOMError(
                 "Components {components} from same group have different foot prints: \
                 {footprints}".format(
                     components=", ".join(refs), footprints=", ".join(footprints)
                 )
             )
-            return False
         footprint = list(footprints)[0]
 
         # They don't seem to like ':' in footprint names.
         footprint = footprint[(footprint.find(":") + 1):]
 
         # Fill in the component groups common data
-        out.writerow([c.getValue(), ",".join(refs), footprint, lcsc_part_number])
-        num_groups_found += 1
+        rows.append([c.getValue(), ",".join(refs), footprint, lcsc_part_number])
 
-    _LOGGER.logger.info(
-        "{} component groups found from BOM file.".format(num_groups_found)
-    )
+    _LOGGER.logger.info("%d component groups found from BOM file.", len(rows) - 1)
+    timings.Count("bom_rows_written", len(rows) - 1)
+
+    return rows
+
+
+@timings.Timed("bom_write")
+def WriteBOM(net, output, opts, components=None):
+    """Write the BOM of an already loaded netlist, or of the given subset of
+    its components, to output, a file name or a text stream. Returns False
+    after logging the reason on failure.
+    """
+    try:
+        rows = GetBOMRows(net, opts, components)
+    except BOMError as e:
+        _LOGGER.logger.error("%s", e)
+        return False
+
+    try:
+        WriteBOMRows(rows, output)
+    except IOError:
+        _LOGGER.logger.error(
+            "Failed to open file for writing: {}".format(output)
+        )
+        return False
 
     return True
+
+
+def WriteVariantBOMs(net, output_filename, opts, variants):
+    """Write the BOM of each of variants (see variants.Variant) of an already
+    loaded netlist, to output_filename with the variant name appended (see
+    variants.VariantPath). Components are grouped per variant, but their
+    records are shared. Returns False after logging the reason if any BOM
+    failed.
+    """
+    ok = True
+    for variant in variants:
+        output = VariantPath(output_filename, variant.name)
+        if WriteBOM(net, output, opts, variant.select(net.components)):
+            _LOGGER.logger.info("Variant %s BOM written to: %s", variant.name, output)
+        else:
+            ok = False
+    return ok
+
+
+def WriteBOMRows(rows, output):
+    """Write BOM rows to output, a file name or a text stream"""
+    with OpenOutput(output, encoding="utf-8") as f:
+        out = csv.writer(
+            f, lineterminator="\n", delimiter=",", quotechar='"', quoting=csv.QUOTE_ALL
+        )
+        out.writerows(rows)
@@ -34,10 +34,14 @@
 
 
 from __future__ import print_function
-import sys
+import contextlib
+import copy
+import io
 import xml.sax as sax
+import xml.parsers.expat as expat
 import re
 import string
+from jlc_kicad_tools import timings
 from jlc_kicad_tools.logger import Log
 
 _LOGGER = Log()
@@ -61,7 +65,7 @@ excluded_fields = [
 #
 # 1) adding a custom field named "Installed" to your components and filling it
 # with a value of "NU" (Normally Uninstalled).
-# See netlist.getInterestingComponents(), or
+# See componentFilter and netlist.getInterestingComponents(), or
 #
 # 2) blacklisting it in any of the three following lists:
 
@@ -85,12 +89,163 @@ excluded_footprints = [
 # -----</Configure>---------------------------------------------------------------
 
 
+# Leading inline global flags, e.g. "(?i)", which only apply to the whole
+# expression and so can't be used inside an alternation as-is.
+_GLOBAL_FLAGS = re.compile(r"\(\?([aiLmsux]+)\)")
+
+# Back references (by number or name) and conditionals, which refer to the
+# groups of their own expression.
+_GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+class patternSet:
+    """A list of regular expressions, matched at the start of the text like
+    re.match. They are combined into a single alternation, except those
+    that mean something else inside one (see _combinable), which are
+    matched separately.
+    """
+
+    def __init__(self, patterns):
+        combined = []
+        self.separate = []
+        for pattern in patterns:
+            combinable = self._combinable(pattern)
+            if combinable is None:
+                self.separate.append(re.compile(pattern))
+            else:
+                combined.append(combinable)
+        self.combined = re.compile("|".join(combined)) if combined else None
+
+    @staticmethod
+    def _combinable(pattern):
+        """Return pattern rewritten to keep its meaning inside an
+        alternation, or None if it has to be matched on its own.
+        """
+        # Raises re.error if the pattern isn't valid on its own.
+        re.compile(pattern)
+        flags = _GLOBAL_FLAGS.match(pattern)
+        if flags:
+            # Scope the flags to the pattern. Verbose comments run to the
+            # end of the line, so end it before the closing parenthesis.
+            end = "\n)" if "x" in flags.group(1) else ")"
+            pattern = "(?{}:{}{}".format(flags.group(1), pattern[flags.end():], end)
+        else:
+            pattern = "(?:{})".format(pattern)
+
+        compiled = re.compile(pattern)
+        if (
+            compiled.flags != re.UNICODE
+            or compiled.groupindex
+            or (compiled.groups and _GROUP_REFERENCE.search(pattern))
+        ):
+            # Global flags elsewhere in the pattern, group names that may
+            # clash, or references to group numbers that would change.
+            return None
+        return pattern
+
+    def match(self, text):
+        if self.combined is not None and self.combined.match(text):
+            return True
+        return any(pattern.match(text) for pattern in self.separate)
+
+
+def compilePatterns(patterns):
+    """Compile a list of regular expressions into a patternSet, which matches
+    (at the start of the text, like re.match) whatever any of them matches.
+    Returns None if patterns is empty.
+    """
+    if not patterns:
+        return None
+    return patternSet(patterns)
+
+
+class componentFilter:
+    """Decides which components are left out of the BOM. Each category of
+    patterns is compiled once, into a patternSet.
+
+    Keywords:
+    references, values, footprints -- lists of regular expressions. A
+    component is excluded if any of them matches the start of its reference,
+    value or footprint.
+    uninstalled -- if True, components with an "Installed" field set to
+    "NU" (Normally Uninstalled) are excluded too.
+    """
+
+    def __init__(self, references=(), values=(), footprints=(), uninstalled=False):
+        self.reference_patterns = list(references)
+        self.value_patterns = list(values)
+        self.footprint_patterns = list(footprints)
+        self.uninstalled = uninstalled
+
+        self.references = compilePatterns(self.reference_patterns)
+        self.values = compilePatterns(self.value_patterns)
+        self.footprints = compilePatterns(self.footprint_patterns)
+
+    @classmethod
+    def fromDefaults(cls):
+        """Return the filter made from excluded_references, excluded_values
+        and excluded_footprints above, also excluding uninstalled components.
+        """
+        return cls(excluded_references, excluded_values, excluded_footprints, True)
+
+    def __bool__(self):
+        return bool(self.references or self.values or self.footprints or self.uninstalled)
+
+    def asDict(self):
+        return {
+            "references": self.reference_patterns,
+            "values": self.value_patterns,
+            "footprints": self.footprint_patterns,
+            "uninstalled": self.uninstalled,
+        }
+
+    def excludes(self, c, libraryToo=True):
+        """Return True if component c is to be left out of the BOM. With
+        libraryToo False, the footprint and fields of its libpart are not
+        looked at, see excludesByLibPart().
+        """
+        if self.references and self.references.match(c.getRef()):
+            return True
+        if self.values and self.values.match(c.getValue()):
+            return True
+        if self.footprints and self.footprints.match(c.getFootprint(libraryToo)):
+            return True
+        # This is a fairly personal way to flag DNS (Do Not Stuff).  NU for
+        # me means Normally Uninstalled.
+        return self.uninstalled and c.getField("Installed", libraryToo) == "NU"
+
+    def excludesByLibPart(self, c):
+        """Return True if component c, which excludes(c, False) kept, is
+        excluded by the footprint or fields it gets from its libpart.
+        """
+        p = c.getLibPart()
+        if not p:
+            return False
+        if self.footprints and c.getFootprint(False) == "" and self.footprints.match(
+            p.getFootprint()
+        ):
+            return True
+        return (
+            self.uninstalled
+            and c.getField("Installed", False) == ""
+            and p.getField("Installed") == "NU"
+        )
+
+
+# Available XML parsing backends for netlist.load(). "sax" is the reference
+# implementation, "expat" drives xml.parsers.expat directly with fewer Python
+# calls per XML event and builds the same tree.
+NETLIST_BACKENDS = ("sax", "expat")
+
+
 class xmlElement:
     """xml element which can represent all nodes of the netlist tree.  It can be
     used to easily generate various output formats by propogating format
     requests to children recursively.
     """
 
+    __slots__ = ("name", "attributes", "parent", "chars", "children")
+
     def __init__(self, name, parent=None):
         self.name = name
         self.attributes = {}
@@ -274,6 +429,29 @@ class xmlElement:
             ret = ret.encode("utf-8")
         return ret
 
+    def getFieldMap(self):
+        """Return a dict mapping field names to values for all 'field'
+        elements in this subtree. Like get("field", "name", name), the first
+        non-empty value found for a name wins.
+        """
+        fields = {}
+        stack = [self]
+        while stack:
+            element = stack.pop()
+            if element.name == "field" and element.chars != "":
+                fields.setdefault(element.attributes.get("name", ""), element.chars)
+            stack.extend(reversed(element.children))
+        return fields
+
+    def getFieldNames(self):
+        """Return the names of the fields in this element's 'fields' child"""
+        fieldNames = []
+        fields = self.getChild("fields")
+        if fields:
+            for f in fields.getChildren():
+                fieldNames.append(f.get("field", "name"))
+        return fieldNames
+
 
 class libpart:
     """Class for a library part, aka 'libpart' in the xml netlist file.
@@ -290,26 +468,38 @@ class libpart:
     # simply print the xmlElement associated with this part
     # return str(self.element)
 
+    def updateCache(self):
+        """Read the data of the wrapped xmlElement into plain attributes so
+        that the accessors don't have to search the element tree. Called by
+        the netlist once the element has been fully parsed.
+        """
+        self._lib = self.element.attributes.get("lib", "")
+        self._part = self.element.attributes.get("part", "")
+        self._description = self.element.get("description")
+        self._fields = self.element.getFieldMap()
+        self._field_names = self.element.getFieldNames()
+
+        aliases = self.element.getChild("aliases")
+        if aliases:
+            self._aliases = [child.get("alias") for child in aliases.getChildren()]
+        else:
+            self._aliases = None
+
     def getLibName(self):
-        return self.element.get("libpart", "lib")
+        return self._lib
 
     def getPartName(self):
-        return self.element.get("libpart", "part")
+        return self._part
 
     def getDescription(self):
-        return self.element.get("description")
+        return self._description
 
     def getField(self, name):
-        return self.element.get("field", "name", name)
+        return self._fields.get(name, "")
 
     def getFieldNames(self):
         """Return a list of field names in play for this libpart."""
-        fieldNames = []
-        fields = self.element.getChild("fields")
-        if fields:
-            for f in fields.getChildren():
-                fieldNames.append(f.get("field", "name"))
-        return fieldNames
+        return list(self._field_names)
 
     def getDatasheet(self):
         return self.getField("Datasheet")
@@ -319,54 +509,122 @@ class libpart:
 
     def getAliases(self):
         """Return a list of aliases or None"""
-        aliases = self.element.getChild("aliases")
-        if aliases:
-            ret = []
-            children = aliases.getChildren()
-            # grab the text out of each child:
-            for child in children:
-                ret.append(child.get("alias"))
-            return ret
-        return None
+        if self._aliases is None:
+            return None
+        return list(self._aliases)
+
+
+class compRecord:
+    """Compact record of the data of a 'comp' element that the accessors of
+    the comp class need. Much smaller than the xmlElement subtree it is read
+    from, which can be dropped once the record is built.
+    """
+
+    __slots__ = (
+        "ref",
+        "value",
+        "footprint",
+        "datasheet",
+        "tstamp",
+        "lib",
+        "part",
+        "description",
+        "fields",
+        "field_names",
+    )
+
+    def __init__(self, xml_element):
+        self.ref = xml_element.attributes.get("ref", "")
+        self.value = xml_element.get("value")
+        self.footprint = xml_element.get("footprint")
+        self.datasheet = xml_element.get("datasheet")
+        self.tstamp = xml_element.get("tstamp")
+        self.fields = xml_element.getFieldMap()
+        self.field_names = tuple(xml_element.getFieldNames())
+
+        libsource = xml_element.getChild("libsource")
+        libsource = libsource.attributes if libsource else {}
+        self.lib = libsource.get("lib", "")
+        self.part = libsource.get("part", "")
+        self.description = libsource.get("description", "")
 
 
 class comp:
     """Class for a component, aka 'comp' in the xml netlist file.
     This component class is implemented by wrapping an xmlElement instance
-    with accessors.  The xmlElement is held in field 'element'.
+    with accessors.  The xmlElement is held in field 'element', and the data
+    read from it in the compRecord in field 'record'. When the netlist is
+    loaded with compact=True, 'element' is released (set to None) once the
+    record has been built.
     """
 
+    __slots__ = ("element", "record", "libpart", "grouped")
+
     def __init__(self, xml_element):
         self.element = xml_element
         self.libpart = None
 
+        # Built by updateCache() once the element has been fully parsed
+        self.record = None
+
         # Set to true when this component is included in a component group
         self.grouped = False
 
+    def updateCache(self):
+        """Rebuild the compRecord from the wrapped xmlElement so that the
+        accessors don't have to search the element tree. Called by the
+        netlist once the element has been fully parsed. Does nothing if the
+        element has been released.
+        """
+        if self.element is not None:
+            self.record = compRecord(self.element)
+
     def __eq__(self, other):
-        """Equivalency operator, remember this can be easily overloaded
-        2 components are equivalent ( i.e. can be grouped
-        if they have same value and same footprint
-
-        Override the component equivalence operator must be done before
-        loading the netlist, otherwise all components will have the original
-        equivalency operator.
-
-        You have to define a comparison module (for instance named myEqu)
-        and add the line;
-            kicad_netlist_reader.comp.__eq__ = myEqu
-        in your bom generator script before calling the netlist reader by something like:
-            net = kicad_netlist_reader.netlist(sys.argv[1])
+        """Equivalency operator. 2 components are equivalent ( i.e. can be
+        grouped ) if they have the same group key, see getGroupKey().
+
+        To change how components are grouped, pass a key function to
+        netlist.groupComponents() rather than overriding this operator.
+        """
+        return self.getGroupKey() == other.getGroupKey()
+
+    def getGroupKey(self):
+        """Return the hashable key components are grouped by: value,
+        footprint, reference prefix and LCSC part number.
         """
-        result = False
-        if self.getValue() == other.getValue():
-            if self.getFootprint() == other.getFootprint():
-                if self.getRef().rstrip(string.digits) == other.getRef().rstrip(
-                    string.digits
-                ):
-                    if self.getLcscPartNumber() == other.getLcscPartNumber():
-                        result = True
-        return result
+        return (
+            self.getValue(),
+            self.getFootprint(),
+            self.getRef().rstrip(string.digits),
+            self.getLcscPartNumber(),
+        )
+
+    def withFields(self, fields):
+        """Return a copy of this component with the fields in the dict
+        fields set to the given values ("Value" and "Footprint" set the
+        value and footprint). The copy shares the libpart, and has no
+        xmlElement.
+        """
+        record = copy.copy(self.record)
+        record.fields = dict(record.fields)
+        field_names = list(record.field_names)
+        for name, value in fields.items():
+            if name == "Value":
+                record.value = value
+            elif name == "Footprint":
+                record.footprint = value
+            else:
+                record.fields[name] = value
+                if name not in field_names:
+                    field_names.append(name)
+        record.field_names = tuple(field_names)
+
+        c = comp.__new__(comp)
+        c.element = None
+        c.record = record
+        c.libpart = self.libpart
+        c.grouped = False
+        return c
 
     def setLibPart(self, part):
         self.libpart = part
@@ -375,19 +633,23 @@ class comp:
         return self.libpart
 
     def getPartName(self):
-        return self.element.get("libsource", "part")
+        return self.record.part
 
     def getLibName(self):
-        return self.element.get("libsource", "lib")
+        return self.record.lib
 
     def setValue(self, value):
         """Set the value of this component"""
+        if self.element is None:
+            self.record.value = value
+            return
         v = self.element.getChild("value")
         if v:
             v.setChars(value)
+            self.record.value = self.element.get("value")
 
     def getValue(self):
-        return self.element.get("value")
+        return self.record.value
 
     def getField(self, name, libraryToo=True):
         """Return the value of a field named name. The component is first
@@ -401,7 +663,7 @@ class comp:
                         in component itself
         """
 
-        field = self.element.get("field", "name", name)
+        field = self.record.fields.get(name, "")
         if field == "" and libraryToo and self.libpart:
             field = self.libpart.getField(name)
         return field
@@ -412,37 +674,32 @@ class comp:
         The netlist format only includes fields with non-empty values.  So if a field
         is empty, it will not be present in the returned list.
         """
-        fieldNames = []
-        fields = self.element.getChild("fields")
-        if fields:
-            for f in fields.getChildren():
-                fieldNames.append(f.get("field", "name"))
-        return fieldNames
+        return list(self.record.field_names)
 
     def getRef(self):
-        return self.element.get("comp", "ref")
+        return self.record.ref
 
     def getFootprint(self, libraryToo=True):
-        ret = self.element.get("footprint")
+        ret = self.record.footprint
         if ret == "" and libraryToo and self.libpart:
             ret = self.libpart.getFootprint()
         return ret
 
     def getDatasheet(self, libraryToo=True):
-        ret = self.element.get("datasheet")
+        ret = self.record.datasheet
         if ret == "" and libraryToo and self.libpart:
             ret = self.libpart.getDatasheet()
         return ret
 
     def getTimestamp(self):
-        return self.element.get("tstamp")
+        return self.record.tstamp
 
     def getDescription(self):
-        return self.element.get("libsource", "description")
+        return self.record.description
 
     def getLcscPartNumber(self):
         lcsc_part_number = None
-        for field_name in self.getFieldNames():
+        for field_name in self.record.field_names:
             field_value = self.getField(field_name).strip()
 
             if LCSC_PART_NUMBER_MATCHER.match(field_value):
@@ -458,11 +715,25 @@ class netlist:
 
     """
 
-    def __init__(self, fname=""):
+    def __init__(
+        self, fname="", sections=None, backend="sax", compact=False, component_filter=None
+    ):
         """Initialiser for the genericNetlist class
 
         Keywords:
         fname -- The name of the generic netlist file to open (Optional)
+        sections -- Names of the top level sections to load, e.g.
+                    ("components", "libparts"). Other sections are skipped
+                    while parsing and never built in memory. If None, the
+                    whole netlist is loaded.
+        backend -- XML parsing backend, one of NETLIST_BACKENDS
+        compact -- If True, the xmlElement subtree of each component is
+                   dropped from the tree as soon as its compRecord is built,
+                   and formatXML()/formatHTML() leave components out.
+        component_filter -- A componentFilter. Components it excludes are
+                   dropped as soon as they are parsed (or once their
+                   libparts are linked, if excluded by a libpart field), and
+                   never appear in self.components.
 
         """
         self.design = None
@@ -476,10 +747,10 @@ class netlist:
 
         self._curr_element = None
 
-        # component blacklist regexs, made from exluded_* above.
-        self.excluded_references = []
-        self.excluded_values = []
-        self.excluded_footprints = []
+        self.sections = sections
+        self.backend = backend
+        self.compact = compact
+        self.component_filter = component_filter or None
 
         if fname != "":
             self.load(fname)
@@ -520,30 +791,46 @@ class netlist:
 
         return self._curr_element
 
+    @timings.Timed("libpart_link")
     def endDocument(self):
         """Called when the netlist document has been fully parsed"""
         # When the document is complete, the library parts must be linked to
         # the components as they are seperate in the tree so as not to
         # duplicate library part information for every component
+        timings.Count("components_parsed", len(self.components))
+
+        libpart_index = self.buildLibPartIndex()
         for c in self.components:
-            for p in self.libparts:
-                if p.getLibName() == c.getLibName():
-                    if p.getPartName() == c.getPartName():
-                        c.setLibPart(p)
-                        break
-                    else:
-                        aliases = p.getAliases()
-                        if aliases and self.aliasMatch(c.getPartName(), aliases):
-                            c.setLibPart(p)
-                            break
+            p = libpart_index.get((c.getLibName(), c.getPartName()))
+            if p is not None:
+                c.setLibPart(p)
 
             if not c.getLibPart():
                 _LOGGER.logger.error(
-                    "Missing libpart for ref {}: {}:{}".format(
-                        c.getRef(), c.getLibName(), c.getPartName()
-                    )
+                    "Missing libpart for ref %s: %s:%s",
+                    c.getRef(),
+                    c.getLibName(),
+                    c.getPartName(),
                 )
 
+        if self.component_filter is not None:
+            kept = [c for c in self.components if not self.component_filter.excludesByLibPart(c)]
+            timings.Count("components_excluded", len(self.components) - len(kept))
+            self.components = kept
+
+    def buildLibPartIndex(self):
+        """Return a dict mapping (lib, part) and (lib, alias) to libparts.
+        When several libparts provide the same name, the first one in the
+        netlist wins.
+        """
+        index = {}
+        for p in self.libparts:
+            lib = p.getLibName()
+            index.setdefault((lib, p.getPartName()), p)
+            for alias in p.getAliases() or []:
+                index.setdefault((lib, alias), p)
+        return index
+
     def aliasMatch(self, partName, aliasList):
         for alias in aliasList:
             if partName == alias:
@@ -552,7 +839,57 @@ class netlist:
 
     def endElement(self):
         """End the current element and switch to its parent"""
-        self._curr_element = self._curr_element.getParent()
+        element = self._curr_element
+        self._curr_element = element.getParent()
+
+        if element.name == "comp":
+            self.endComponent(element)
+        elif element.name == "libpart":
+            self.endLibPart(element)
+
+    def endLibPart(self, element):
+        """Called once the 'libpart' element 'element' has been fully parsed.
+        Builds the cache of the libpart wrapping it.
+        """
+        p = self.libparts[-1] if self.libparts else None
+        if p is not None and p.element is element:
+            p.updateCache()
+
+    def endComponent(self, element):
+        """Called once the 'comp' element 'element' has been fully parsed.
+        Builds the record of the component wrapping it, then drops the
+        component if the component filter excludes it, and compacts it if
+        the netlist is compact.
+        """
+        c = self.components[-1] if self.components else None
+        if c is None or c.element is not element:
+            return
+
+        c.updateCache()
+        if self.component_filter is not None and self.component_filter.excludes(c, False):
+            if self.compact:
+                self.compactComponent(element)
+            self.components.pop()
+            timings.Count("components_parsed")
+            timings.Count("components_excluded")
+            return
+
+        if self.compact:
+            self.compactComponent(element)
+
+    def compactComponent(self, element):
+        """Release 'element', the element of the last component, once its
+        record has been built, and remove it from the tree.
+        """
+        c = self.components[-1] if self.components else None
+        if c is None or c.element is not element:
+            return
+
+        c.element = None
+
+        parent = element.getParent()
+        if parent is not None and parent.children and parent.children[-1] is element:
+            parent.children.pop()
 
     def getDate(self):
         """Return the date + time string generated by the tree creation tool"""
@@ -607,59 +944,18 @@ class netlist:
 
         return ret  # this is a python 'set'
 
-    def getInterestingComponents(self):
+    def getInterestingComponents(self, component_filter=None):
         """Return a subset of all components, those that should show up in the BOM.
-        Omit those that should not, by consulting the blacklists:
-        excluded_values, excluded_refs, and excluded_footprints, which hold one
-        or more regular expressions.  If any of the the regular expressions match
-        the corresponding field's value in a component, then the component is exluded.
+        Omit those that component_filter, a componentFilter, excludes. If None,
+        the filter is made from the blacklists: excluded_values, excluded_refs,
+        and excluded_footprints, which hold one or more regular expressions,
+        and components with an "Installed" field of "NU" are omitted too.
         """
-
-        # pre-compile all the regex expressions:
-        del self.excluded_references[:]
-        del self.excluded_values[:]
-        del self.excluded_footprints[:]
-
-        for rex in excluded_references:
-            self.excluded_references.append(re.compile(rex))
-
-        for rex in excluded_values:
-            self.excluded_values.append(re.compile(rex))
-
-        for rex in excluded_footprints:
-            self.excluded_footprints.append(re.compile(rex))
+        if component_filter is None:
+            component_filter = componentFilter.fromDefaults()
 
         # the subset of components to return, considered as "interesting".
-        ret = []
-
-        # run each component thru a series of tests, if it passes all, then add it
-        # to the interesting list 'ret'.
-        for c in self.components:
-            exclude = False
-            if not exclude:
-                for refs in self.excluded_references:
-                    if refs.match(c.getRef()):
-                        exclude = True
-                        break
-            if not exclude:
-                for vals in self.excluded_values:
-                    if vals.match(c.getValue()):
-                        exclude = True
-                        break
-            if not exclude:
-                for mods in self.excluded_footprints:
-                    if mods.match(c.getFootprint()):
-                        exclude = True
-                        break
-
-            if not exclude:
-                # This is a fairly personal way to flag DNS (Do Not Stuff).  NU for
-                # me means Normally Uninstalled.  You can 'or in' another expression here.
-                if c.getField("Installed") == "NU":
-                    exclude = True
-
-            if not exclude:
-                ret.append(c)
+        ret = [c for c in self.components if not component_filter.excludes(c)]
 
         # The key to sort the components in the BOM
         # This sorts using a natural sorting order (e.g. 100 after 99), and if it wasn't used
@@ -673,39 +969,32 @@ class netlist:
 
         return ret
 
-    def groupComponents(self, components=None):
+    @timings.Timed("group")
+    def groupComponents(self, components=None, key=None):
         """Return a list of component lists. Components are grouped together
-        when the value, library and part identifiers match.
+        when their group keys match.
 
         Keywords:
         components -- is a list of components, typically an interesting subset
         of all components, or None.  If None, then all components are looked at.
+        key -- a function taking a component and returning a hashable group
+        key. Defaults to comp.getGroupKey.
         """
         if not components:
             components = self.components
 
-        groups = []
+        if key is None:
+            key = comp.getGroupKey
 
-        # Make sure to start off will all components ungrouped to begin with
+        # Bucket components by their group key. Dicts keep insertion order, so
+        # groups come out in order of their first component.
+        buckets = {}
         for c in components:
-            c.grouped = False
+            c.grouped = True
+            buckets.setdefault(key(c), []).append(c)
 
-        # Group components based on the value, library and part identifiers
-        for c in components:
-            if c.grouped is False:
-                c.grouped = True
-                newgroup = []
-                newgroup.append(c)
-
-                # Check every other ungrouped component against this component
-                # and add to the group as necessary
-                for ci in components:
-                    if ci.grouped is False and ci == c:
-                        newgroup.append(ci)
-                        ci.grouped = True
-
-                # Add the new component group to the groups list
-                groups.append(newgroup)
+        groups = list(buckets.values())
+        timings.Count("groups_formed", len(groups))
 
         # The key to sort the components in the BOM
         # This sorts using a natural sorting order (e.g. 100 after 99), and if it wasn't used
@@ -774,20 +1063,34 @@ class netlist:
         """Return the whole netlist formatted in HTML"""
         return self.tree.formatHTML()
 
+    @timings.Timed("netlist_parse")
     def load(self, fname):
         """Load a kicad generic netlist
 
         Keywords:
-        fname -- The name of the generic netlist file to open
+        fname -- The name of the generic netlist file to open. The netlist
+                 itself may also be given, as bytes or as a file-like object.
 
+        Raises IOError if the file can't be read, and the XML parser's
+        exceptions if it isn't a well-formed netlist.
         """
-        try:
+        if self.backend not in NETLIST_BACKENDS:
+            raise ValueError("Unknown netlist backend: {}".format(self.backend))
+
+        if isinstance(fname, (bytes, bytearray)):
+            fname = io.BytesIO(fname)
+
+        if self.backend == "expat":
+            self._reader = _expatNetReader(self, self.sections)
+        else:
             self._reader = sax.make_parser()
-            self._reader.setContentHandler(_gNetReader(self))
-            self._reader.parse(fname)
-        except IOError as e:
-            _LOGGER.logger.error("{}: {}".format(__file__, e))
-            sys.exit(-1)
+            self._reader.setContentHandler(_gNetReader(self, self.sections))
+            if isinstance(fname, str):
+                # SAX would take a missing file name for a URL.
+                with open(fname, "rb") as f:
+                    self._reader.parse(f)
+                return
+        self._reader.parse(fname)
 
 
 class _gNetReader(sax.handler.ContentHandler):
@@ -796,20 +1099,47 @@ class _gNetReader(sax.handler.ContentHandler):
 
     """
 
-    def __init__(self, aParent):
+    def __init__(self, aParent, sections=None):
         self.parent = aParent
+        self.sections = sections
+
+        # Depth of the current element in the loaded tree, and depth inside
+        # a skipped section (0 when not skipping)
+        self._depth = 0
+        self._skip_depth = 0
 
     def startElement(self, name, attrs):
         """Start of a new XML element event"""
+        if self._skip_depth:
+            self._skip_depth += 1
+            return
+
+        if (
+            self._depth == 1
+            and self.sections is not None
+            and name not in self.sections
+        ):
+            self._skip_depth = 1
+            return
+
+        self._depth += 1
         element = self.parent.addElement(name)
 
         for name in attrs.getNames():
             element.addAttribute(name, attrs.getValue(name))
 
     def endElement(self, name):
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+
+        self._depth -= 1
         self.parent.endElement()
 
     def characters(self, content):
+        if self._skip_depth:
+            return
+
         # Ignore erroneous white space - ignoreableWhitespace does not get rid
         # of the need for this!
         if not content.isspace():
@@ -818,3 +1148,102 @@ class _gNetReader(sax.handler.ContentHandler):
     def endDocument(self):
         """End of the XML document event"""
         self.parent.endDocument()
+
+
+class _expatNetReader:
+    """xml.parsers.expat kicad generic netlist reader. Builds the same tree in
+    RAM as _gNetReader, but each expat event is handled by a single Python
+    call instead of going through the SAX layer and netlist.addElement.
+
+    """
+
+    # Same chunk size as the SAX expat reader, so that character data is
+    # split (and whitespace-only chunks dropped) in exactly the same places.
+    BUFSIZE = 2 ** 16 - 20
+
+    def __init__(self, aParent, sections=None):
+        self.parent = aParent
+        self.sections = sections
+
+        self._curr_element = None
+        self._depth = 0
+        self._skip_depth = 0
+
+        # Lists of the netlist that elements with these names are added to.
+        self._collections = {
+            "comp": (aParent.components, comp),
+            "libpart": (aParent.libparts, libpart),
+            "net": (aParent.nets, None),
+            "library": (aParent.libraries, None),
+        }
+
+    def parse(self, fname):
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+
+        if hasattr(fname, "read"):
+            source = contextlib.nullcontext(fname)
+        else:
+            source = open(fname, "rb")
+
+        with source as f:
+            while True:
+                data = f.read(self.BUFSIZE)
+                if not data:
+                    break
+                parser.Parse(data, False)
+        parser.Parse(b"", True)
+
+        self.parent.endDocument()
+
+    def startElement(self, name, attrs):
+        if self._skip_depth:
+            self._skip_depth += 1
+            return
+
+        parent = self._curr_element
+        if parent is None:
+            element = xmlElement(name)
+            self.parent.tree = element
+        elif (
+            self._depth == 1
+            and self.sections is not None
+            and name not in self.sections
+        ):
+            self._skip_depth = 1
+            return
+        else:
+            element = xmlElement(name, parent)
+            parent.children.append(element)
+
+        element.attributes = attrs
+        self._curr_element = element
+        self._depth += 1
+
+        collection = self._collections.get(name)
+        if collection is not None:
+            elements, wrapper = collection
+            elements.append(wrapper(element) if wrapper else element)
+        elif name == "design":
+            self.parent.design = element
+
+    def endElement(self, name):
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+
+        self._depth -= 1
+        element = self._curr_element
+        self._curr_element = element.parent
+
+        if name == "comp":
+            self.parent.endComponent(element)
+        elif name == "libpart":
+            self.parent.endLibPart(element)
+
+    def characters(self, content):
+        # Ignore erroneous white space, as in _gNetReader
+        if not self._skip_depth and not content.isspace():
+            self._curr_element.chars += content
@@ -0,0 +1,129 @@
+# Copyright (C) 2019 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Reader for KiCad boards (.kicad_pcb), so that CPLs can be made without
+exporting a footprint position file from Pcbnew first.
+
+ReadFootprintRows() returns the rows of the CSV position file Pcbnew exports
+with its default settings (all footprints, millimetres, page origin), so
+they are transformed exactly like an exported file. Only footprints are
+parsed: tracks, zones and drawings, which make up most of a large board,
+are skipped.
+"""
+
+from jlc_kicad_tools import timings
+from jlc_kicad_tools.jlc_lib import sexpr
+
+PCB_EXTENSION = ".kicad_pcb"
+
+# Header of the CSV position files exported by Pcbnew
+CPL_HEADER = ("Ref", "Val", "Package", "PosX", "PosY", "Rot", "Side")
+
+# Footprint attributes that leave a footprint out of position files, as
+# written by KiCad 6+ and KiCad 5
+EXCLUDED_ATTRIBUTES = frozenset(("exclude_from_pos_files", "virtual"))
+
+# Top-level items of a board that are read (footprints are modules in
+# KiCad 5 boards)
+_BOARD_ITEMS = frozenset(("footprint", "module"))
+
+# Lists inside footprints that are never used, and skipped while reading
+_SKIPPED_LISTS = frozenset(
+    (
+        "effects",
+        "pad",
+        "model",
+        "fp_line",
+        "fp_arc",
+        "fp_circle",
+        "fp_rect",
+        "fp_poly",
+        "fp_curve",
+        "fp_text_box",
+        "zone",
+        "group",
+        "dimension",
+    )
+)
+
+
+class BoardError(Exception):
+    """Raised when a board can't be read"""
+
+
+def _Text(footprint, property_name, text_type):
+    # KiCad 8+ footprint properties, then KiCad 5-7 footprint texts
+    for item in sexpr.FindAll(footprint, "property"):
+        if len(item) > 2 and item[1] == property_name:
+            return item[2]
+    for item in sexpr.FindAll(footprint, "fp_text"):
+        if len(item) > 2 and item[1] == text_type:
+            return item[2]
+    return ""
+
+
+def _Number(text, filename):
+    try:
+        return float(text)
+    except ValueError:
+        raise BoardError("{}: Invalid footprint position: {!r}".format(filename, text))
+
+
+@timings.Timed("board_parse")
+def ReadFootprintRows(filename):
+    """Return the rows, header first, of the CSV position file Pcbnew would
+    export for the board in filename.
+
+    Raises BoardError if the board is malformed, and IOError if it can't be
+    read.
+    """
+    footprints = []
+    try:
+        with open(filename, encoding="utf-8") as f:
+            items = sexpr.ReadItems(f, _BOARD_ITEMS, _SKIPPED_LISTS)
+            if next(items) != "kicad_pcb":
+                raise BoardError("Not a KiCad board: {}".format(filename))
+            for footprint in items:
+                attributes = sexpr.Find(footprint, "attr") or []
+                if EXCLUDED_ATTRIBUTES.intersection(attributes[1:]):
+                    continue
+
+                fpid = footprint[1] if len(footprint) > 1 else ""
+                at = (sexpr.Find(footprint, "at") or []) + ["0", "0", "0"]
+                x = _Number(at[1], filename)
+                y = _Number(at[2], filename)
+                rotation = _Number(at[3], filename)
+                footprints.append(
+                    [
+                        _Text(footprint, "Reference", "reference"),
+                        _Text(footprint, "Value", "value"),
+                        # The footprint name, without its library
+                        fpid.split(":", 1)[-1],
+                        "{0:.6f}".format(x),
+                        # Position files have Y pointing up (+ 0.0 turns
+                        # -0.0 into 0.0).
+                        "{0:.6f}".format(-y + 0.0),
+                        "{0:.6f}".format(rotation),
+                        "bottom" if sexpr.Get(footprint, "layer") == "B.Cu" else "top",
+                    ]
+                )
+    except sexpr.SExprError as e:
+        raise BoardError("{}: {}".format(filename, e))
+
+    footprints.sort(key=lambda row: sexpr.NaturalKey(row[0]))
+    timings.Count("footprints_parsed", len(footprints))
+    return [list(CPL_HEADER)] + footprints
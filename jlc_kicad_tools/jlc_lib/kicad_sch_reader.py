@@ -0,0 +1,393 @@
+# Copyright (C) 2019 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Reader for KiCad 6+ schematics (.kicad_sch), so that BOMs can be made
+without exporting a netlist from Eeschema first.
+
+ReadSchematic() walks the sheet hierarchy and returns a
+kicad_netlist_reader.netlist, built from the same elements Eeschema writes
+in the XML netlist's components and libparts sections, so the comp and
+libpart accessors work unchanged. Like in netlists, power symbols and flags
+(references starting with '#') and symbols excluded from the BOM
+('in_bom no') are left out, and the units of multi-unit symbols make a
+single component.
+"""
+
+import os
+from dataclasses import dataclass, field
+
+from jlc_kicad_tools import timings
+from jlc_kicad_tools.jlc_lib import kicad_netlist_reader, sexpr
+
+SCHEMATIC_EXTENSION = ".kicad_sch"
+
+# Symbol properties stored in their own netlist elements, not as fields
+MANDATORY_PROPERTIES = ("Reference", "Value", "Footprint", "Datasheet")
+
+# Property names of sheets, as written by KiCad 7+ and KiCad 6
+SHEET_NAME_PROPERTIES = ("Sheetname", "Sheet name")
+SHEET_FILE_PROPERTIES = ("Sheetfile", "Sheet file")
+
+# Library symbol description, as written by KiCad 6/7 and KiCad 8+
+DESCRIPTION_PROPERTIES = ("ki_description", "Description")
+
+# Top-level items of a schematic that are read; everything else (wires,
+# labels, graphics...) is skipped.
+_SCHEMATIC_ITEMS = frozenset(("uuid", "lib_symbols", "symbol", "sheet", "symbol_instances"))
+
+# Lists inside those items that are never used, and skipped while reading
+_SKIPPED_LISTS = frozenset(
+    (
+        "at",
+        "effects",
+        "pin",
+        "stroke",
+        "fill",
+        "size",
+        "rectangle",
+        "polyline",
+        "circle",
+        "arc",
+        "bezier",
+        "text",
+        "pin_names",
+        "pin_numbers",
+    )
+)
+
+
+class SchematicError(Exception):
+    """Raised when a schematic can't be read"""
+
+
+@dataclass
+class _Symbol:
+    lib_id: str
+    lib_name: str
+    uuid: str
+    # (name, value) in file order
+    properties: list
+    # KiCad 7+ instance path -> reference
+    instances: dict
+    in_bom: bool = True
+
+
+@dataclass
+class _SheetFile:
+    uuid: str = ""
+    # Symbol name -> properties dict
+    lib_symbols: dict = field(default_factory=dict)
+    symbols: list = field(default_factory=list)
+    # (uuid, name, file name)
+    sheets: list = field(default_factory=list)
+    # KiCad 6 root schematics: symbol path -> (reference, value, footprint)
+    symbol_instances: dict = field(default_factory=dict)
+
+
+@dataclass
+class _Component:
+    ref: str
+    value: str
+    footprint: str
+    datasheet: str
+    fields: list
+    lib: str
+    part: str
+    description: str
+    sheet_names: str
+    sheet_tstamps: str
+    tstamps: list
+
+
+def _Properties(item):
+    return [(p[1], p[2]) for p in sexpr.FindAll(item, "property") if len(p) > 2]
+
+
+def _FirstOf(properties, names, default=""):
+    for name in names:
+        if name in properties:
+            return properties[name]
+    return default
+
+
+def _ReadSymbol(item):
+    instances = {}
+    for project in sexpr.FindAll(sexpr.Find(item, "instances") or [], "project"):
+        for path in sexpr.FindAll(project, "path"):
+            instances.setdefault(path[1], sexpr.Get(path, "reference", None))
+    return _Symbol(
+        lib_id=sexpr.Get(item, "lib_id"),
+        lib_name=sexpr.Get(item, "lib_name", None),
+        uuid=sexpr.Get(item, "uuid"),
+        properties=_Properties(item),
+        instances=instances,
+        in_bom=sexpr.Get(item, "in_bom", "yes") != "no",
+    )
+
+
+def _ReadSheetFile(filename, wanted=_SCHEMATIC_ITEMS):
+    sheet_file = _SheetFile()
+    try:
+        with open(filename, encoding="utf-8") as f:
+            items = sexpr.ReadItems(f, wanted, _SKIPPED_LISTS)
+            if next(items) != "kicad_sch":
+                raise SchematicError("Not a KiCad schematic: {}".format(filename))
+
+            for item in items:
+                kind = item[0]
+                if kind == "symbol":
+                    sheet_file.symbols.append(_ReadSymbol(item))
+                elif kind == "sheet":
+                    properties = dict(_Properties(item))
+                    sheet_file.sheets.append(
+                        (
+                            sexpr.Get(item, "uuid"),
+                            _FirstOf(properties, SHEET_NAME_PROPERTIES),
+                            _FirstOf(properties, SHEET_FILE_PROPERTIES),
+                        )
+                    )
+                elif kind == "lib_symbols":
+                    for symbol in sexpr.FindAll(item, "symbol"):
+                        sheet_file.lib_symbols[symbol[1]] = dict(_Properties(symbol))
+                elif kind == "uuid":
+                    sheet_file.uuid = item[1]
+                elif kind == "symbol_instances":
+                    for path in sexpr.FindAll(item, "path"):
+                        sheet_file.symbol_instances[path[1]] = (
+                            sexpr.Get(path, "reference"),
+                            sexpr.Get(path, "value", None),
+                            sexpr.Get(path, "footprint", None),
+                        )
+    except sexpr.SExprError as e:
+        raise SchematicError("{}: {}".format(filename, e))
+    return sheet_file
+
+
+def _SheetInstances(filename, root_dir, cache, wanted, uuids=(), names=(), files=()):
+    """Yield (sheet file, sheet uuids, sheet names) for the sheet in filename
+    and, depth first, each sheet below it. Files used by several sheets are
+    read once, and only their items named in wanted.
+    """
+    sheet_file = cache.get(filename)
+    if sheet_file is None:
+        sheet_file = cache[filename] = _ReadSheetFile(filename, wanted)
+    yield sheet_file, uuids, names
+
+    files += (filename,)
+    for uuid, name, sheet_filename in sheet_file.sheets:
+        # Sheet file names are relative to the sheet using them or, in older
+        # schematics, to the root schematic.
+        path = os.path.normpath(os.path.join(os.path.dirname(filename), sheet_filename))
+        if not os.path.isfile(path):
+            path = os.path.normpath(os.path.join(root_dir, sheet_filename))
+        if not os.path.isfile(path):
+            raise SchematicError(
+                "Sheet file of sheet '{}' not found: {}".format(name, sheet_filename)
+            )
+        if path in files:
+            raise SchematicError("Sheet file used by itself: {}".format(path))
+        yield from _SheetInstances(
+            path, root_dir, cache, wanted, uuids + (uuid,), names + (name,), files
+        )
+
+
+def _SplitLibId(lib_id):
+    if ":" not in lib_id:
+        return "", lib_id
+    return tuple(lib_id.split(":", 1))
+
+
+def _ReadComponents(filename):
+    """Return the components of the schematic hierarchy rooted at filename,
+    sorted by reference, and the library symbols they use by (lib, part).
+    """
+    filename = os.path.abspath(filename)
+    cache = {}
+    components = {}
+    libparts = {}
+    root = None
+
+    for sheet_file, uuids, names in _SheetInstances(
+        filename, os.path.dirname(filename), cache, _SCHEMATIC_ITEMS
+    ):
+        if root is None:
+            root = sheet_file
+        # Instance paths of symbols on this sheet, as KiCad 7+ and KiCad 6
+        # write them.
+        instance_path = "/" + root.uuid + "".join("/" + uuid for uuid in uuids)
+        sheet_tstamps = "".join("/" + uuid for uuid in uuids) + "/"
+        sheet_names = "".join("/" + name for name in names) + "/"
+
+        for symbol in sheet_file.symbols:
+            if not symbol.in_bom:
+                continue
+            properties = dict(symbol.properties)
+            ref = symbol.instances.get(instance_path)
+            value = properties.get("Value", "")
+            footprint = properties.get("Footprint", "")
+            old_instance = root.symbol_instances.get(sheet_tstamps + symbol.uuid)
+            if old_instance is not None:
+                ref = old_instance[0]
+                if old_instance[1] is not None:
+                    value = old_instance[1]
+                if old_instance[2] is not None:
+                    footprint = old_instance[2]
+            if ref is None:
+                ref = properties.get("Reference", "")
+            if ref.startswith("#"):
+                continue
+
+            component = components.get(ref)
+            if component is not None:
+                # Another unit of a multi-unit symbol
+                component.tstamps.append(symbol.uuid)
+                names_seen = set(name for name, _ in component.fields)
+                component.fields += [
+                    (name, value)
+                    for name, value in symbol.properties
+                    if name not in names_seen
+                    and name not in MANDATORY_PROPERTIES
+                    and not name.startswith("ki_")
+                    and value != ""
+                ]
+                continue
+
+            lib, part = _SplitLibId(symbol.lib_id)
+            lib_symbol = sheet_file.lib_symbols.get(symbol.lib_name or symbol.lib_id, {})
+            libparts.setdefault((lib, part), lib_symbol)
+            components[ref] = _Component(
+                ref=ref,
+                value=value,
+                footprint=footprint,
+                datasheet=properties.get("Datasheet", ""),
+                fields=[
+                    (name, value)
+                    for name, value in symbol.properties
+                    if name not in MANDATORY_PROPERTIES
+                    and not name.startswith("ki_")
+                    and value != ""
+                ],
+                lib=lib,
+                part=part,
+                description=_FirstOf(lib_symbol, DESCRIPTION_PROPERTIES),
+                sheet_names=sheet_names,
+                sheet_tstamps=sheet_tstamps,
+                tstamps=[symbol.uuid],
+            )
+
+    return [components[ref] for ref in sorted(components, key=sexpr.NaturalKey)], libparts
+
+
+def _Add(net, tag, chars="", **attributes):
+    element = net.addElement(tag)
+    for attribute, value in attributes.items():
+        element.addAttribute(attribute, value)
+    if chars:
+        net.addChars(chars)
+    return element
+
+
+@timings.Timed("schematic_parse")
+def ReadSchematic(filename, sections=None, compact=False, component_filter=None):
+    """Read the schematic hierarchy whose root sheet is in filename, and
+    return it as a kicad_netlist_reader.netlist.
+
+    Keywords:
+    sections -- Names of the netlist sections to build, e.g.
+                ("components", "libparts"). If None, all of them.
+    compact, component_filter -- See kicad_netlist_reader.netlist.
+
+    Raises SchematicError if the schematic is malformed or a sheet file is
+    missing, and IOError if a file can't be read.
+    """
+    components, libparts = _ReadComponents(filename)
+
+    net = kicad_netlist_reader.netlist(
+        sections=sections, compact=compact, component_filter=component_filter
+    )
+    _Add(net, "export", version="E")
+
+    if sections is None or "design" in sections:
+        _Add(net, "design")
+        _Add(net, "source", os.path.abspath(filename))
+        net.endElement()
+        _Add(net, "tool", "jlc-kicad-tools")
+        net.endElement()
+        net.endElement()
+
+    if sections is None or "components" in sections:
+        _Add(net, "components")
+        for c in components:
+            _Add(net, "comp", ref=c.ref)
+            _Add(net, "value", c.value)
+            net.endElement()
+            if c.footprint:
+                _Add(net, "footprint", c.footprint)
+                net.endElement()
+            if c.datasheet:
+                _Add(net, "datasheet", c.datasheet)
+                net.endElement()
+            if c.fields:
+                _Add(net, "fields")
+                for name, value in c.fields:
+                    _Add(net, "field", value, name=name)
+                    net.endElement()
+                net.endElement()
+            _Add(net, "libsource", lib=c.lib, part=c.part, description=c.description)
+            net.endElement()
+            _Add(net, "sheetpath", names=c.sheet_names, tstamps=c.sheet_tstamps)
+            net.endElement()
+            _Add(net, "tstamps", " ".join(c.tstamps))
+            net.endElement()
+            net.endElement()
+        net.endElement()
+
+    if sections is None or "libparts" in sections:
+        _Add(net, "libparts")
+        for (lib, part), properties in libparts.items():
+            _Add(net, "libpart", lib=lib, part=part)
+            description = _FirstOf(properties, DESCRIPTION_PROPERTIES)
+            if description:
+                _Add(net, "description", description)
+                net.endElement()
+            datasheet = properties.get("Datasheet", "")
+            if datasheet:
+                _Add(net, "docs", datasheet)
+                net.endElement()
+            _Add(net, "fields")
+            for name in MANDATORY_PROPERTIES:
+                if properties.get(name):
+                    _Add(net, "field", properties[name], name=name)
+                    net.endElement()
+            net.endElement()
+            net.endElement()
+        net.endElement()
+
+    net.endElement()
+    net.endDocument()
+    return net
+
+
+def ListSchematicFiles(filename):
+    """Return the files of the schematic hierarchy rooted at filename, root
+    first.
+    """
+    filename = os.path.abspath(filename)
+    cache = {}
+    for _ in _SheetInstances(filename, os.path.dirname(filename), cache, ("sheet",)):
+        pass
+    return list(cache)
@@ -0,0 +1,163 @@
+# Copyright (C) 2019 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Panel descriptions, used to replicate the placements of a board on every
+board of a panel.
+
+A panel is described in JSON, either as a list of instances:
+
+    {"instances": [{"x": 0, "y": 0},
+                   {"x": 110, "y": 80, "rotation": 180}]}
+
+or as a grid of identical instances:
+
+    {"grid": {"columns": 3, "rows": 2, "pitch_x": 55, "pitch_y": 40}}
+
+Each board is rotated counter-clockwise about its origin by "rotation"
+degrees (0, 90, 180 or 270), then moved by ("x", "y") mm. Designators get a
+suffix to stay unique on the panel: "suffix" is a template, given for the
+whole panel or per instance, where {n} is the instance number (from 1), and
+{column} and {row} the grid position. The default is "_{n}".
+"""
+
+import json
+from dataclasses import dataclass
+
+DEFAULT_SUFFIX = "_{n}"
+
+INSTANCE_ROTATIONS = (0, 90, 180, 270)
+
+
+class PanelError(Exception):
+    """Raised when a panel description is invalid"""
+
+
+@dataclass
+class PanelInstance:
+    offset_x: float = 0.0
+    offset_y: float = 0.0
+    rotation: int = 0
+    suffix: str = ""
+
+    def place(self, x, y, rotation, bottom):
+        """Return the panel position and JLC rotation of a part placed at
+        (x, y) with JLC rotation 'rotation' on this instance's board.
+        """
+        if self.rotation == 90:
+            x, y = -y, x
+        elif self.rotation == 180:
+            x, y = -x, -y
+        elif self.rotation == 270:
+            x, y = y, -x
+        if self.rotation:
+            # JLC bottom-side rotations turn the other way, see FixRotations.
+            if bottom:
+                rotation = (rotation - self.rotation) % 360
+            else:
+                rotation = (rotation + self.rotation) % 360
+        if self.offset_x:
+            x += self.offset_x
+        if self.offset_y:
+            y += self.offset_y
+        return x, y, rotation
+
+
+class Panel:
+    """The board instances of a panel, in output order"""
+
+    def __init__(self, instances):
+        if not instances:
+            raise PanelError("Panel has no instances")
+        self.instances = instances
+
+    def __len__(self):
+        return len(self.instances)
+
+
+def _Number(description, key, default=0.0):
+    value = description.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise PanelError("'{}' must be a number, not {!r}".format(key, value))
+    return float(value)
+
+
+def _Instance(description, n, column, row, defaults):
+    if not isinstance(description, dict):
+        raise PanelError("Panel instance {} is not an object".format(n))
+    rotation = description.get("rotation", defaults.get("rotation", 0))
+    if rotation not in INSTANCE_ROTATIONS:
+        raise PanelError(
+            "Panel instance {} rotation must be one of {}, not {!r}".format(
+                n, ", ".join(str(r) for r in INSTANCE_ROTATIONS), rotation
+            )
+        )
+    suffix = description.get("suffix", defaults.get("suffix", DEFAULT_SUFFIX))
+    try:
+        suffix = suffix.format(n=n, column=column, row=row)
+    except (AttributeError, KeyError, IndexError, ValueError) as e:
+        raise PanelError("Invalid designator suffix {!r}: {}".format(suffix, e))
+    return PanelInstance(
+        offset_x=_Number(description, "x"),
+        offset_y=_Number(description, "y"),
+        rotation=int(rotation),
+        suffix=suffix,
+    )
+
+
+def ParsePanel(description):
+    """Return the Panel of a decoded JSON panel description. Raises
+    PanelError if it is invalid.
+    """
+    if not isinstance(description, dict):
+        raise PanelError("Panel description is not an object")
+
+    instances = []
+    if "grid" in description:
+        grid = description["grid"]
+        if not isinstance(grid, dict):
+            raise PanelError("'grid' is not an object")
+        columns = int(_Number(grid, "columns", 1))
+        rows = int(_Number(grid, "rows", 1))
+        pitch_x = _Number(grid, "pitch_x")
+        pitch_y = _Number(grid, "pitch_y")
+        for row in range(rows):
+            for column in range(columns):
+                instances.append(
+                    _Instance(
+                        {"x": column * pitch_x, "y": row * pitch_y},
+                        len(instances) + 1,
+                        column + 1,
+                        row + 1,
+                        description,
+                    )
+                )
+    for instance in description.get("instances", []):
+        instances.append(_Instance(instance, len(instances) + 1, None, None, description))
+
+    return Panel(instances)
+
+
+def LoadPanel(filename):
+    """Read a JSON panel description. Raises PanelError if it is invalid,
+    and IOError if it can't be read.
+    """
+    with open(filename, encoding="utf-8") as f:
+        try:
+            description = json.load(f)
+        except ValueError as e:
+            raise PanelError("{}: {}".format(filename, e))
+    return ParsePanel(description)
@@ -0,0 +1,243 @@
+# Copyright (C) 2019 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Streaming reader for the S-expression files of KiCad 6 and later
+(.kicad_sch, .kicad_pcb).
+
+Only the top-level items a caller asks for are tokenized and built, as
+nested lists:
+
+    (symbol (lib_id "Device:R") (uuid 1234))
+
+is read as ["symbol", ["lib_id", "Device:R"], ["uuid", "1234"]]. Quoted
+strings and bare atoms are both returned as str. Everything else, such as
+the tracks and zones that make up most of a board, is skipped a chunk at a
+time by counting parentheses, without being tokenized.
+"""
+
+import re
+
+# Size of the chunks files are read in
+CHUNK_SIZE = 1 << 16
+
+# One token per match: an atom, a parenthesis, or a quoted string (which may
+# contain escaped quotes and newlines). A lone '"' is an unterminated string,
+# and means the text ended inside a string. Most common tokens first.
+_TOKEN = re.compile(r'[^\s()"]+|[()]|"[^"\\]*(?:\\.[^"\\]*)*"|"', re.DOTALL)
+
+# Quoted strings, removed from skipped text before counting parentheses
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+# The opening of the outermost list, and its name
+_ROOT = re.compile(r'\s*\(([^\s()"]+)[\s()]')
+
+_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+_ESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+
+# Smallest number of characters tokenized to read an item
+_MIN_WINDOW = 1 << 12
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+class SExprError(Exception):
+    """Raised when an S-expression file is malformed"""
+
+
+def _Unescape(match):
+    return _ESCAPES.get(match.group(1), match.group(1))
+
+
+def Value(token):
+    """Return the text of an atom or quoted string token"""
+    if token[:1] != '"':
+        return token
+    text = token[1:-1]
+    if "\\" in text:
+        text = _ESCAPE.sub(_Unescape, text)
+    return text
+
+
+def ReadList(tokens, name, skip=frozenset()):
+    """Build the list whose '(' and name have just been read from tokens,
+    up to its closing ')'. Nested lists named in skip are left out.
+    """
+    stack = [[name]]
+    for token in tokens:
+        if token == "(":
+            token = next(tokens, ")")
+            if token == ")":
+                stack[-1].append([])
+            elif token in skip:
+                SkipList(tokens)
+            else:
+                stack.append([Value(token)])
+        elif token == ")":
+            item = stack.pop()
+            if not stack:
+                return item
+            stack[-1].append(item)
+        else:
+            stack[-1].append(Value(token))
+    raise SExprError("Unexpected end of file in '{}'".format(name))
+
+
+def SkipList(tokens):
+    """Skip the rest of the list whose '(' has just been read from tokens"""
+    depth = 1
+    for token in tokens:
+        if token == ")":
+            depth -= 1
+            if not depth:
+                return
+        elif token == "(":
+            depth += 1
+    raise SExprError("Unexpected end of file")
+
+
+def _ReadItem(buffer, start, end, skip):
+    """Build the item whose '(' is at buffer[start] from the text before
+    end, or return None if it doesn't end there.
+    """
+    # Tokenize up to the next line starting a top-level item, which is where
+    # KiCad ends the item, then over ever larger windows.
+    stop = buffer.find("\n  (", start + 1, end)
+    if stop < 0:
+        stop = end
+    while True:
+        tokens = _TOKEN.findall(buffer, start + 1, stop)
+        if tokens and '"' not in tokens:
+            tokens = iter(tokens)
+            try:
+                return ReadList(tokens, Value(next(tokens)), skip)
+            except SExprError:
+                # The tokens ran out.
+                pass
+        if stop >= end:
+            return None
+        stop = min(end, start + max(_MIN_WINDOW, 2 * (stop - start)))
+
+
+def ReadItems(f, wanted, skip=frozenset(), chunk_size=CHUNK_SIZE):
+    """Read the S-expression in text stream f, and yield those of its
+    top-level items whose name is in wanted, as nested lists without the
+    lists named in skip. Yields the name of the outermost list first.
+    """
+    # Items are found by their opening as KiCad writes it, '(' then the name.
+    item_start = re.compile(
+        r"\((?:{})[\s()]".format("|".join(re.escape(name) for name in sorted(wanted)))
+        if wanted
+        else r"(?!)"
+    )
+
+    buffer = ""
+    eof = False
+
+    def More():
+        # Read at least as much again as what is carried over, so that long
+        # items are re-read a bounded number of times.
+        chunk = f.read(max(chunk_size, len(buffer) - pos))
+        return buffer[pos:] + chunk, not chunk
+
+    pos = 0
+    root = None
+    while root is None and not eof:
+        buffer, eof = More()
+        root = _ROOT.match(buffer)
+    if root is None:
+        raise SExprError("Not an S-expression file")
+    yield root.group(1)
+
+    # The parentheses depth is known at pos, which is never inside a string.
+    # Text from pos up to the next candidate item, or up to the last newline
+    # read, is only counted.
+    pos = search = root.end(1)
+    depth = 1
+    while True:
+        # KiCad ends every line between tokens, so the text up to the last
+        # newline only ends inside a string if a string spans lines.
+        end = len(buffer) if eof else buffer.rfind("\n") + 1
+        match = item_start.search(buffer, search, end) if search < end else None
+        stop = match.start() if match else max(end, pos)
+
+        text = buffer[pos:stop]
+        if '"' in text:
+            text = _STRING.sub("", text)
+            if '"' in text:
+                # The candidate, or the text read so far, is inside a string.
+                if match:
+                    search = match.start() + 1
+                    continue
+                if eof:
+                    raise SExprError("Unterminated string")
+                search -= pos
+                buffer, eof = More()
+                pos = 0
+                continue
+        depth += text.count("(") - text.count(")")
+        pos = stop
+
+        if match is None:
+            if eof:
+                break
+            buffer, eof = More()
+            pos = search = 0
+            continue
+
+        search = pos + 1
+        if depth != 1:
+            continue
+
+        item = _ReadItem(buffer, pos, end, skip)
+        if item is None:
+            if eof:
+                raise SExprError("Unexpected end of file")
+            # Read on, and come back to this item. Its parentheses are
+            # counted like those of any other text once it has been read.
+            buffer, eof = More()
+            pos = search = 0
+            continue
+        yield item
+
+    if depth != 0:
+        raise SExprError("Unexpected end of file")
+
+
+def Find(item, name):
+    """Return the first child list of item named name, or None"""
+    for child in item:
+        if type(child) is list and child and child[0] == name:
+            return child
+    return None
+
+
+def FindAll(item, name):
+    """Return the child lists of item named name"""
+    return [child for child in item if type(child) is list and child and child[0] == name]
+
+
+def Get(item, name, default=""):
+    """Return the first value of the child list of item named name"""
+    child = Find(item, name)
+    if child is None or len(child) < 2 or type(child[1]) is list:
+        return default
+    return child[1]
+
+
+def NaturalKey(ref):
+    """Sort key ordering references naturally, e.g. R2 before R10"""
+    return [int(part) if part.isdigit() else part for part in _DIGITS.split(ref)]
@@ -0,0 +1,56 @@
+# Copyright (C) 2019 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Helpers letting the library functions take either file names or in-memory
+data and streams, so they can be used without temporary files.
+"""
+
+import contextlib
+import io
+
+
+def OpenTextInput(source, encoding="utf-8"):
+    """Return a context manager yielding a text stream for source, which may
+    be a file name, bytes, or a text or binary file-like object. Streams
+    passed in are not closed.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return contextlib.closing(io.StringIO(bytes(source).decode(encoding)))
+    if isinstance(source, str):
+        return open(source, encoding=encoding, newline="")
+    if isinstance(source.read(0), bytes):
+        return _Detached(io.TextIOWrapper(source, encoding=encoding, newline=""))
+    return contextlib.nullcontext(source)
+
+
+def OpenOutput(output, **open_kwargs):
+    """Return a context manager yielding a text stream for output, which may
+    be a file name or a writable text stream. Streams passed in are not
+    closed.
+    """
+    if isinstance(output, str):
+        return open(output, "w", **open_kwargs)
+    return contextlib.nullcontext(output)
+
+
+@contextlib.contextmanager
+def _Detached(wrapper):
+    # Don't close the caller's binary stream along with the wrapper.
+    try:
+        yield wrapper
+    finally:
+        wrapper.detach()
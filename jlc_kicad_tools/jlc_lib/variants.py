@@ -0,0 +1,218 @@
+# Copyright (C) 2019 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Assembly variants, used to make the BOMs and CPLs of several variants of
+a board from a single netlist.
+
+Variants are described in JSON:
+
+    {"variants": [
+        {"name": "full"},
+        {"name": "lite",
+         "exclude": [{"ref": "R1[0-9]"}, {"fields": {"Installed": "NU"}}]},
+        {"name": "alt",
+         "overrides": [{"ref": "U1", "set": {"LCSC": "C7426"}}]}
+    ]}
+
+Rules select components by "ref", "value" and "footprint", and by the
+"fields" given, each a regular expression that must match the whole text.
+A rule matches when all of its expressions do. A variant places the
+components matching any of its "include" rules (all of them if there are
+none), except those matching any of its "exclude" rules. "overrides" set
+the fields (or "Value" and "Footprint") of the components their rule
+matches, later overrides winning.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+
+# Variant names end up in file names.
+VARIANT_NAME_MATCHER = re.compile(r"^[\w.-]+$")
+
+
+class VariantError(Exception):
+    """Raised when a variants description is invalid"""
+
+
+@dataclass
+class Rule:
+    ref: object = None
+    value: object = None
+    footprint: object = None
+    # Field name -> compiled pattern
+    fields: dict = field(default_factory=dict)
+
+    def matches(self, component):
+        if self.ref is not None and not self.ref.fullmatch(component.getRef()):
+            return False
+        if self.value is not None and not self.value.fullmatch(component.getValue()):
+            return False
+        if self.footprint is not None and not self.footprint.fullmatch(
+            component.getFootprint()
+        ):
+            return False
+        for name, pattern in self.fields.items():
+            if not pattern.fullmatch(component.getField(name)):
+                return False
+        return True
+
+
+@dataclass
+class Override:
+    rule: Rule
+    # Field name -> value
+    values: dict
+
+
+@dataclass
+class Variant:
+    name: str
+    include: list = field(default_factory=list)
+    exclude: list = field(default_factory=list)
+    overrides: list = field(default_factory=list)
+
+    def places(self, component):
+        """Return True if component is assembled in this variant"""
+        if self.include and not any(rule.matches(component) for rule in self.include):
+            return False
+        return not any(rule.matches(component) for rule in self.exclude)
+
+    def select(self, components):
+        """Return the components assembled in this variant, with their
+        overrides applied. Components without overrides are returned as-is,
+        the others are copies (see comp.withFields).
+        """
+        selected = []
+        for component in components:
+            if not self.places(component):
+                continue
+            values = {}
+            for override in self.overrides:
+                if override.rule.matches(component):
+                    values.update(override.values)
+            if values:
+                component = component.withFields(values)
+            selected.append(component)
+        return selected
+
+
+def VariantPath(path, name):
+    """Return the output path of variant name for output path, e.g.
+    board_bom_jlc_lite.csv for board_bom_jlc.csv
+    """
+    base, extension = os.path.splitext(path)
+    return "{}_{}{}".format(base, name, extension)
+
+
+def _Pattern(description, key, where):
+    pattern = description.get(key)
+    if pattern is None:
+        return None
+    if not isinstance(pattern, str):
+        raise VariantError("{}: '{}' must be a string, not {!r}".format(where, key, pattern))
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise VariantError("{}: invalid '{}' pattern {!r}: {}".format(where, key, pattern, e))
+
+
+def _Rule(description, where):
+    if not isinstance(description, dict):
+        raise VariantError("{}: rule is not an object".format(where))
+    fields = description.get("fields", {})
+    if not isinstance(fields, dict):
+        raise VariantError("{}: 'fields' is not an object".format(where))
+    rule = Rule(
+        ref=_Pattern(description, "ref", where),
+        value=_Pattern(description, "value", where),
+        footprint=_Pattern(description, "footprint", where),
+        fields={name: _Pattern(fields, name, where) for name in fields},
+    )
+    if rule == Rule():
+        raise VariantError("{}: rule matches nothing in particular".format(where))
+    return rule
+
+
+def _Rules(description, key, where):
+    rules = description.get(key, [])
+    if not isinstance(rules, list):
+        raise VariantError("{}: '{}' is not a list".format(where, key))
+    return [_Rule(rule, "{} {} rule {}".format(where, key, i + 1)) for i, rule in enumerate(rules)]
+
+
+def _Override(description, where):
+    values = description.get("set") if isinstance(description, dict) else None
+    if not isinstance(values, dict) or not values:
+        raise VariantError("{}: override has no 'set' object".format(where))
+    for name, value in values.items():
+        if not isinstance(value, str):
+            raise VariantError("{}: '{}' must be set to a string, not {!r}".format(where, name, value))
+    rule = {key: value for key, value in description.items() if key != "set"}
+    return Override(rule=_Rule(rule, where), values=values)
+
+
+def ParseVariants(description):
+    """Return the list of Variant of a decoded JSON variants description.
+    Raises VariantError if it is invalid.
+    """
+    variants = description.get("variants") if isinstance(description, dict) else None
+    if not isinstance(variants, list) or not variants:
+        raise VariantError("Variants description has no 'variants' list")
+
+    parsed = []
+    for i, variant in enumerate(variants):
+        if not isinstance(variant, dict):
+            raise VariantError("Variant {} is not an object".format(i + 1))
+        name = variant.get("name")
+        if not isinstance(name, str) or not VARIANT_NAME_MATCHER.match(name):
+            raise VariantError(
+                "Variant {} name must be letters, digits, '_', '-' or '.', not {!r}".format(
+                    i + 1, name
+                )
+            )
+        if any(other.name == name for other in parsed):
+            raise VariantError("Duplicate variant name: {}".format(name))
+        where = "Variant '{}'".format(name)
+        overrides = variant.get("overrides", [])
+        if not isinstance(overrides, list):
+            raise VariantError("{}: 'overrides' is not a list".format(where))
+        parsed.append(
+            Variant(
+                name=name,
+                include=_Rules(variant, "include", where),
+                exclude=_Rules(variant, "exclude", where),
+                overrides=[
+                    _Override(override, "{} override {}".format(where, j + 1))
+                    for j, override in enumerate(overrides)
+                ],
+            )
+        )
+    return parsed
+
+
+def LoadVariants(filename):
+    """Read a JSON variants description. Raises VariantError if it is
+    invalid, and IOError if it can't be read.
+    """
+    with open(filename, encoding="utf-8") as f:
+        try:
+            description = json.load(f)
+        except ValueError as e:
+            raise VariantError("{}: {}".format(filename, e))
+    return ParseVariants(description)
@@ -20,6 +20,11 @@
 import logging
 import logzero
 
+# Log level for per-item detail (e.g. every CPL row), below DEBUG. Enabled
+# with three -v flags.
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
 
 class Log:
     def __init__(self):
@@ -30,7 +35,8 @@ class Log:
 
     def SetLevel(self, level):
         # Default log level is WARNING
-        logzero.loglevel(max(logging.WARNING - level * 10, logging.NOTSET))
+        # Levels below TRACE would be NOTSET, which defers to the root logger.
+        logzero.loglevel(max(logging.WARNING - level * 10, TRACE))
         self.logger.debug(
-            "Log level to %s", max(logging.WARNING - level * 10, logging.NOTSET)
+            "Log level to %s", max(logging.WARNING - level * 10, TRACE)
         )
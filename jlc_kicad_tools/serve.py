@@ -0,0 +1,361 @@
+# Copyright (C) 2019 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Long-lived worker answering requests read as JSON lines, for callers that
+would otherwise start the command (and compile the databases) for every file.
+
+Each request is a JSON object on one line:
+
+    {"id": 1, "netlist": "board.xml", "bom_output": "board_bom_jlc.csv",
+     "cpl": "board-all-pos.csv", "cpl_output": "board_cpl_jlc.csv"}
+
+"netlist" and "cpl" are the input file names, either may be left out. They
+may also name a KiCad 6+ root schematic (.kicad_sch) and board (.kicad_pcb).
+The file contents can be sent as "netlist_data" and "cpl_data" instead.
+Without "bom_output" or "cpl_output", the rows are returned in the response
+instead. "database" optionally lists the rotation databases to use instead of
+the server's, "panel" a panel to replicate the CPL on (a panel description
+file name or the description itself, see panel.py), and "options" overrides
+the server's BOM options warn_no_partnumber and include_all_groups (true or
+false) and netlist_backend. The server's exclusion rules apply to every
+request.
+
+Every request gets one response line, in completion order:
+
+    {"id": 1, "ok": true, "bom_output": "board_bom_jlc.csv",
+     "cpl_output": "board_cpl_jlc.csv", "timings": {...}}
+
+Failed requests have "ok": false and an "errors" object keyed by "bom",
+"cpl" or "request".
+"""
+
+import argparse
+import concurrent.futures
+import dataclasses
+import errno
+import io
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+
+from jlc_kicad_tools import timings
+from jlc_kicad_tools.generate_jlc_files import AddGenerationOptions, GetComponentFilter
+from jlc_kicad_tools.jlc_lib.cpl_fix_rotations import (
+    ClearDBCache,
+    GenerateCPLRows,
+    ReadRotationRules,
+    WriteCPL,
+)
+from jlc_kicad_tools.jlc_lib.generate_bom import (
+    BOMOptions,
+    ExclusionError,
+    GetBOMRows,
+    LoadNetlist,
+    WriteBOMRows,
+)
+from jlc_kicad_tools.jlc_lib.kicad_netlist_reader import NETLIST_BACKENDS
+from jlc_kicad_tools.jlc_lib.panel import LoadPanel, ParsePanel
+from jlc_kicad_tools.logger import Log
+
+_LOGGER = Log()
+
+# BOM options requests may override -> (check of the value, what it must be)
+REQUEST_OPTIONS = {
+    "warn_no_partnumber": (lambda value: isinstance(value, bool), "true or false"),
+    "include_all_groups": (lambda value: isinstance(value, bool), "true or false"),
+    "netlist_backend": (
+        lambda value: isinstance(value, str) and value in NETLIST_BACKENDS,
+        "one of {}".format(", ".join(NETLIST_BACKENDS)),
+    ),
+}
+
+
+class RequestError(Exception):
+    """Raised when a request is malformed"""
+
+
+def GetServeOpts(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Generates JLCPCB BOM and CPL files for requests read as JSON lines "
+        "from stdin or a Unix socket, writing one JSON line response per request",
+        prog="jlc-kicad-tools serve",
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        metavar="PATH",
+        type=os.path.abspath,
+        help="Listen for connections on a Unix socket at PATH instead of reading stdin",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Number of requests processed in parallel, in worker processes if more than 1. \
+        Default: 1",
+    )
+    AddGenerationOptions(parser)
+
+    return parser.parse_args(argv)
+
+
+# Per-process state of request workers, set up once by _InitWorker.
+_OPTS = None
+_BOM_OPTIONS = None
+# Database file names -> (modification times, compiled rules)
+_DBS = {}
+_DBS_LOCK = threading.Lock()
+
+
+def _InitWorker(db, opts):
+    global _OPTS, _BOM_OPTIONS
+    _OPTS = opts
+    _BOM_OPTIONS = BOMOptions(
+        warn_no_partnumber=opts.warn_no_partnumber,
+        include_all_groups=opts.include_all_groups,
+        netlist_backend=opts.netlist_backend,
+        component_filter=opts.component_filter,
+    )
+    _DBS[tuple(opts.database)] = (_DBStamps(opts.database), db)
+    _LOGGER.SetLevel(opts.verbose_count)
+
+
+def _DBStamps(filenames):
+    return tuple(os.stat(filename).st_mtime_ns for filename in filenames)
+
+
+def GetDB(filenames):
+    """Return the compiled rules of the databases in filenames. They are only
+    compiled again if one of the files changed since the last request.
+    """
+    filenames = tuple(filenames)
+    stamps = _DBStamps(filenames)
+    with _DBS_LOCK:
+        cached = _DBS.get(filenames)
+        if cached is None or cached[0] != stamps:
+            cached = _DBS[filenames] = (
+                stamps,
+                ReadRotationRules(filenames, not _OPTS.no_db_cache),
+            )
+    return cached[1]
+
+
+def _Describe(error):
+    return "{}: {}".format(type(error).__name__, error)
+
+
+def _Input(request, name):
+    # File names are given as "netlist"/"cpl", contents as "netlist_data"/"cpl_data".
+    if request.get(name) is not None:
+        return request[name]
+    if request.get(name + "_data") is not None:
+        return io.StringIO(request[name + "_data"])
+    return None
+
+
+def _GetBOMOptions(request):
+    """Return the server's BOM options with the overrides of request.
+    Raises RequestError if they are invalid.
+    """
+    options = request.get("options", {})
+    if not isinstance(options, dict):
+        raise RequestError('"options" must be an object')
+    for name, value in options.items():
+        if name not in REQUEST_OPTIONS:
+            raise RequestError(
+                "Unknown option {!r}, expected one of {}".format(name, ", ".join(REQUEST_OPTIONS))
+            )
+        check, expected = REQUEST_OPTIONS[name]
+        if not check(value):
+            raise RequestError("Option {!r} must be {}, not {!r}".format(name, expected, value))
+    return dataclasses.replace(_BOM_OPTIONS, **options)
+
+
+def _GenerateBOM(request, opts, response):
+    net = LoadNetlist(_Input(request, "netlist"), opts)
+    with timings.Stage("bom_write"):
+        rows = GetBOMRows(net, opts)
+        if request.get("bom_output") is None:
+            response["bom_rows"] = rows
+        else:
+            WriteBOMRows(rows, request["bom_output"])
+            response["bom_output"] = request["bom_output"]
+
+
+def _GenerateCPL(request, response):
+    with timings.Stage("db_load"):
+        db = GetDB(request.get("database", _OPTS.database))
+    panel = request.get("panel")
+    if isinstance(panel, str):
+        panel = LoadPanel(panel)
+    elif panel is not None:
+        panel = ParsePanel(panel)
+    if request.get("cpl_output") is None:
+        response["cpl_rows"] = GenerateCPLRows(_Input(request, "cpl"), db, _OPTS.cpl_backend, panel)
+    else:
+        WriteCPL(_Input(request, "cpl"), request["cpl_output"], db, _OPTS.cpl_backend, panel)
+        response["cpl_output"] = request["cpl_output"]
+
+
+def HandleRequest(request):
+    """Process a decoded request and return its response"""
+    response = {"id": request.get("id"), "ok": True}
+    errors = {}
+
+    with timings.Recording() as recorded:
+        has_netlist = _Input(request, "netlist") is not None
+        has_cpl = _Input(request, "cpl") is not None
+        try:
+            if not has_netlist and not has_cpl:
+                raise RequestError("Request has neither a netlist nor a CPL")
+            opts = _GetBOMOptions(request)
+        except RequestError as e:
+            errors["request"] = str(e)
+            has_netlist = has_cpl = False
+        if has_netlist:
+            try:
+                _GenerateBOM(request, opts, response)
+            except Exception as e:
+                errors["bom"] = _Describe(e)
+        if has_cpl:
+            try:
+                _GenerateCPL(request, response)
+            except Exception as e:
+                errors["cpl"] = _Describe(e)
+
+    if errors:
+        response["ok"] = False
+        response["errors"] = errors
+        for stage, error in errors.items():
+            _LOGGER.logger.error("Request {} {}: {}".format(response["id"], stage, error))
+    response["timings"] = recorded.asDict()
+    return response
+
+
+def ServeStream(infile, outfile, executor):
+    """Answer the requests read from infile, writing one response line per
+    request to outfile as soon as it's ready. Returns once infile ends and
+    all of its requests have been answered.
+    """
+    lock = threading.Lock()
+    pending = set()
+
+    def Respond(response):
+        line = json.dumps(response) + "\n"
+        with lock:
+            outfile.write(line)
+            outfile.flush()
+
+    def Done(request_id, future):
+        pending.discard(future)
+        try:
+            Respond(future.result())
+        except Exception as e:
+            # The worker itself failed (e.g. a worker process died).
+            Respond({"id": request_id, "ok": False, "errors": {"request": _Describe(e)}})
+
+    for line in infile:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            Respond({"id": None, "ok": False, "errors": {"request": "Invalid JSON: {}".format(e)}})
+            continue
+        if not isinstance(request, dict):
+            Respond({"id": None, "ok": False, "errors": {"request": "Request is not an object"}})
+            continue
+
+        future = executor.submit(HandleRequest, request)
+        pending.add(future)
+        future.add_done_callback(lambda f, request_id=request.get("id"): Done(request_id, f))
+
+    concurrent.futures.wait(list(pending))
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        with self.request.makefile("r", encoding="utf-8") as infile, self.request.makefile(
+            "w", encoding="utf-8"
+        ) as outfile:
+            ServeStream(infile, outfile, self.server.executor)
+
+
+def ServeSocket(path, executor):
+    """Answer the requests of every connection to a Unix socket at path, until
+    interrupted or terminated.
+    """
+    if os.path.exists(path):
+        _LOGGER.logger.error("Socket path already exists: {}".format(path))
+        return errno.EEXIST
+
+    with socketserver.ThreadingUnixStreamServer(path, _ConnectionHandler) as server:
+        server.daemon_threads = True
+        server.executor = executor
+        _LOGGER.logger.info("Listening on {}".format(path))
+        # Stop as on Ctrl-C, so the socket is removed.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+    return 0
+
+
+def main(argv=None):
+
+    opts = GetServeOpts(sys.argv[1:] if argv is None else argv)
+
+    _LOGGER.SetLevel(opts.verbose_count)
+
+    # Exclusion rules are read once, and apply to every request.
+    try:
+        opts.component_filter = GetComponentFilter(opts)
+    except (IOError, ExclusionError) as e:
+        _LOGGER.logger.error("Invalid exclusion rules: {}".format(e))
+        return errno.EINVAL
+
+    if opts.clear_db_cache:
+        ClearDBCache()
+
+    # The default databases are compiled once, here, and handed to each
+    # worker process when it starts.
+    db = ReadRotationRules(opts.database, not opts.no_db_cache)
+
+    if opts.jobs <= 1:
+        _InitWorker(db, opts)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=opts.jobs, initializer=_InitWorker, initargs=(db, opts)
+        )
+
+    with executor:
+        if opts.socket:
+            return ServeSocket(opts.socket, executor)
+        ServeStream(sys.stdin, sys.stdout, executor)
+
+    return 0
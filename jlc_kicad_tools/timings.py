@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright (C) 2019-2020 Matthew Lai
+#
+# This file is part of JLC Kicad Tools.
+#
+# JLC Kicad Tools is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JLC Kicad Tools is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with JLC Kicad Tools.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import functools
+import threading
+import time
+
+
+class Timings:
+    """Wall and CPU time per processing stage, plus named counters.
+
+    Stages may nest (e.g. libpart linking runs inside netlist parsing). The
+    time recorded for a stage excludes the time spent in stages nested in
+    it, so that the stages of a run add up to its total. CPU time is per
+    thread, so stages running concurrently in threads are measured correctly.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self._local.__dict__.setdefault("stack", [])
+        # [wall, cpu] spent in stages nested in this one
+        nested = [0.0, 0.0]
+        stack.append(nested)
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            with self._lock:
+                entry = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+                entry["wall"] += wall - nested[0]
+                entry["cpu"] += cpu - nested[1]
+                entry["calls"] += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def asDict(self):
+        with self._lock:
+            return {
+                "total": {
+                    "wall": time.perf_counter() - self._start_wall,
+                    "cpu": time.process_time() - self._start_cpu,
+                },
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+# Timings of the current run, if recording is enabled.
+_ACTIVE = None
+
+# Per-thread recordings (see Recording), which take precedence over _ACTIVE.
+_LOCAL = threading.local()
+
+
+def _Current():
+    return getattr(_LOCAL, "timings", None) or _ACTIVE
+
+
+def Start():
+    """Start recording timings and return the Timings being recorded into"""
+    global _ACTIVE
+    _ACTIVE = Timings()
+    return _ACTIVE
+
+
+def Stop():
+    """Stop recording timings and return what was recorded (or None)"""
+    global _ACTIVE
+    timings, _ACTIVE = _ACTIVE, None
+    return timings
+
+
+@contextlib.contextmanager
+def Recording():
+    """Context manager recording the timings of the calling thread only, e.g.
+    of one of several requests handled concurrently. Yields the Timings.
+    """
+    timings = Timings()
+    previous = getattr(_LOCAL, "timings", None)
+    _LOCAL.timings = timings
+    try:
+        yield timings
+    finally:
+        _LOCAL.timings = previous
+
+
+def Stage(name):
+    """Context manager timing a stage, a no-op unless recording is enabled"""
+    timings = _Current()
+    if timings is None:
+        return contextlib.nullcontext()
+    return timings.stage(name)
+
+
+def Count(name, n=1):
+    """Add n to a counter, if recording is enabled"""
+    timings = _Current()
+    if timings is not None:
+        timings.count(name, n)
+
+
+def Timed(name):
+    """Decorator timing every call of a function as stage 'name'"""
+
+    def Decorator(function):
+        @functools.wraps(function)
+        def Wrapper(*args, **kwargs):
+            with Stage(name):
+                return function(*args, **kwargs)
+
+        return Wrapper
+
+    return Decorator
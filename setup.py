@@ -15,7 +15,8 @@ setup(
     python_requires='>=3.7',
     install_requires=['logzero>=1.5'],
     entry_points={"console_scripts": [
-                    "jlc-kicad-tools = jlc_kicad_tools.generate_jlc_files:main"
+                    "jlc-kicad-tools = jlc_kicad_tools.generate_jlc_files:main",
+                    "jlc-kicad-tools-batch = jlc_kicad_tools.generate_jlc_files:batch_main",
                 ]
     },
 )